@@ -1,21 +1,135 @@
 import os
 import ast
+import json
+import logging
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from anytree import PreOrderIter
+from regulations_rag.render_cache import RenderCache
+from regulations_rag.corpus_bundle import CorpusBundle
+from regulations_rag.embeddings import num_tokens_from_string
+from regulations_rag.regulation_table_of_content import split_documents_parallel
+from regulations_rag.term_scanner import CorpusScanner
+
+logger = logging.getLogger(__name__)
+DEV_LEVEL = 15
+logging.addLevelName(DEV_LEVEL, 'DEV')
+
+
+class LazyDocument:
+    """
+    A placeholder for a Document that is only constructed the first time it is used. Document constructors load their
+    source data and build their table of content so a corpus of lazy documents only pays for the documents that are
+    used in the session.
+
+    Construction is thread-safe: if several threads ask for the document at the same time, the factory is only
+    called once. Attributes that are not on the proxy are looked up on the document so a LazyDocument can be used
+    wherever a Document is expected.
+
+    Parameters:
+        factory (callable): Returns the Document, typically the Document class itself.
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._document = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._document is not None
+
+    def get(self):
+        document = self._document
+        if document is None:
+            with self._lock:
+                if self._document is None:
+                    logger.log(DEV_LEVEL, f"Loading the document {getattr(self._factory, '__name__', self._factory)}")
+                    self._document = self._factory()
+                document = self._document
+        return document
+
+    def __getattr__(self, name):
+        # only called for attributes that are not on the proxy
+        if name.startswith("__") or name in ("_factory", "_document", "_lock"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __getstate__(self):
+        return {"_factory": self._factory, "_document": self._document}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
 
 class Corpus:
     """
     A class representing a collection of documents.
     
     Attributes:
-    all_documents (dict): A dictionary where keys are the class names and values are instances of these classes.
+    all_documents (dict): A dictionary where keys are the class names and values are instances of these classes (or
+                          LazyDocument proxies that construct the instance on first use).
                           NOTE: In the "document" field of the index database is a text value that will be matched
                                 against the key in this dictionary.
+    render_cache (RenderCache): A bounded cache of the text returned by get_text(...). Set render_cache_max_bytes to 0 
+                                to disable it.
+
+    If toc_cache_folder is provided, each document's table of content is loaded from a snapshot in that folder during
+    construction (or built and saved if the document has changed). See Document.get_cached_toc(). This loads all
+    the lazy documents.
+
+    The keys in warmup are loaded during construction so the first request for them does not pay for the load.
+
+    If bundle (a CorpusBundle or the path to one) is provided, each document gets its rendered sections and table of
+    content from the bundle, if its data matches the bundle, when it is first returned by get_document(...). See 
+    regulations_rag.corpus_bundle.
     """
 
-    def __init__(self, document_dictionary):
+    def __init__(self, document_dictionary, render_cache_max_bytes=32 * 1024 * 1024, toc_cache_folder=None, warmup=None, bundle=None):
         self.all_documents = document_dictionary
+        self.render_cache = RenderCache(max_bytes=render_cache_max_bytes)
+        self._reference_scanner = None
+        self.bundle = CorpusBundle(bundle) if isinstance(bundle, str) else bundle
+        self._bundled_documents = set()
+        if warmup:
+            self.warmup(warmup)
+        if toc_cache_folder:
+            for document_key in self.all_documents:
+                document = self.get_document(document_key)
+                document.toc_cache_folder = toc_cache_folder
+                document.get_cached_toc()
 
     def get_document(self, document_key):
-        return self.all_documents.get(document_key)
+        document = self.all_documents.get(document_key)
+        if self.bundle is not None and document is not None and document_key not in self._bundled_documents:
+            self._bundled_documents.add(document_key)
+            return self._get_bundled_document(document_key, document)
+        if isinstance(document, LazyDocument):
+            document = document.get()
+        return document
+
+    def _get_bundled_document(self, document_key, document):
+        if isinstance(document, LazyDocument):
+            document = document.get()
+        if not self.bundle.apply_to_document(document_key, document):
+            # the reference scanner may have been built from the document's table of content in the bundle
+            self._reference_scanner = None
+        return document
+
+    def is_document_loaded(self, document_key):
+        document = self.all_documents.get(document_key)
+        if isinstance(document, LazyDocument):
+            return document.is_loaded
+        return document is not None
+
+    def warmup(self, document_keys):
+        """
+        Constructs the (lazy) documents in document_keys now rather than on first use.
+        """
+        for document_key in document_keys:
+            if self.get_document(document_key) is None:
+                logger.warning(f"Unable to warm up {document_key} because it is not in the corpus")
 
     def get_heading(self, document_key, section_reference):
         doc = self.get_document(document_key)
@@ -27,51 +141,208 @@ class Corpus:
     def get_text(self, document_key, section_reference, add_markdown_decorators=True, add_headings=True, section_only=False):
         doc = self.get_document(document_key)
         if doc:
-            return doc.get_text(section_reference, add_markdown_decorators, add_headings, section_only)
+            key = RenderCache.make_key(document_key, section_reference, add_markdown_decorators, add_headings, section_only)
+            text = self.render_cache.get(key)
+            if text is None:
+                text = doc.get_stored_text(section_reference, add_markdown_decorators, add_headings, section_only)
+                if text is None:
+                    text = doc.get_text(section_reference, add_markdown_decorators, add_headings, section_only)
+                self.render_cache.put(key, text)
+            return text
+        return None
+
+    def get_token_count(self, document_key, section_reference, add_markdown_decorators=True, add_headings=True, section_only=False):
+        """
+        Returns the number of tokens in the text returned by get_text(...), using the token count saved in the
+        document's section store if there is one.
+        """
+        doc = self.get_document(document_key)
+        if doc:
+            token_count = doc.get_stored_token_count(section_reference, add_markdown_decorators, add_headings, section_only)
+            if token_count is None:
+                token_count = num_tokens_from_string(self.get_text(document_key, section_reference, add_markdown_decorators, add_headings, section_only))
+            return token_count
         return None
 
-def create_document_dictionary_from_folder(folder_name, namespace_dict=None):
+    def reload_document(self, document_key, document):
+        """
+        Replaces (or adds) the document stored under document_key and removes any text rendered from the previous
+        version of the document from the render cache.
+        """
+        self.all_documents[document_key] = document
+        self.render_cache.invalidate_document(document_key)
+        self._reference_scanner = None
+        # the bundle is checked again because the new version of the document may not match it
+        self._bundled_documents.discard(document_key)
+
+    def get_section_references(self, document_key):
+        """
+        Returns the references in the document's table of content. A lazy document that has not been loaded yet is
+        not loaded if the bundle has its table of content.
+        """
+        document = self.all_documents.get(document_key)
+        if self.bundle is not None and isinstance(document, LazyDocument) and not document.is_loaded:
+            references = self.bundle.get_toc_references(document_key)
+            if references is not None:
+                return references
+        toc = self.get_document(document_key).get_cached_toc()
+        return [node.full_node_name for node in PreOrderIter(toc.root) if node is not toc.root and node.full_node_name]
+
+    def get_reference_scanner(self):
+        """
+        Returns a CorpusScanner over the references in every document's table of content (see 
+        get_section_references(...)). It is built on first use.
+        """
+        if self._reference_scanner is None:
+            self._reference_scanner = CorpusScanner(corpus=self)
+        return self._reference_scanner
+
+    def find_references(self, text):
+        """
+        Returns the (document_key, section_reference) tuples of all the known references in text, for example to
+        check the references cited in an LLM response.
+        """
+        return self.get_reference_scanner().find_references(text)
+
+def split_corpus(corpus, token_limit, max_workers=None):
+    """
+    Chunks every document in the corpus into sections that don't exceed token_limit, using a process pool across
+    documents and their top-level table of content nodes.
+
+    Returns:
+    pd.DataFrame: A DataFrame with columns ['document', 'section_reference', 'text', 'token_count'] where 'document'
+                  is the key of the document in the corpus.
+    """
+    documents = {document_key: corpus.get_document(document_key) for document_key in corpus.all_documents}
+    return split_documents_parallel(documents, token_limit, max_workers)
+
+def create_document_dictionary_from_folder(folder_name, namespace_dict=None, lazy=False, discovery_cache_file=None):
     """
     Create a dictionary of document instances from Python classes defined in the files within a given folder.
 
     Args:
     folder_name (str): The name of the folder where the Python files are located.
     namespace_dict (dict): Optional dictionary to look up classes.
+    lazy (bool): If True, the values are LazyDocument proxies and each class is only instantiated when it is first used.
+    discovery_cache_file (str): Optional discovery cache, see find_class_names_in_files().
 
     Returns:
     dict: A dictionary where keys are the class names and values are instances of these classes.
     """
-    class_names_dict = find_class_names_in_files(folder_name)
+    class_names_dict = find_class_names_in_files(folder_name, cache_file=discovery_cache_file)
     all_documents = {}
     for class_name, file_class_name in class_names_dict.items():
         doc_class = get_document_class_by_name(file_class_name, namespace_dict)
         if doc_class:
-            all_documents[file_class_name] = doc_class()
+            all_documents[file_class_name] = LazyDocument(doc_class) if lazy else doc_class()
     return all_documents
 
-def find_class_names_in_files(directory):
+DISCOVERY_CACHE_VERSION = 1
+# Discovery caches that could not be written. The warning is only logged once for each of them.
+_unwritable_discovery_caches = set()
+# Below this number of files that need to be parsed it is quicker to parse them in this process than to start a pool
+MIN_FILES_FOR_PARALLEL_DISCOVERY = 16
+
+def first_class_name_in_file(filepath):
+    """
+    Returns the name of the first class defined in a python file or None. Classes defined in the body of the module
+    are checked first. If there are none, the rest of the syntax tree is searched breadth first.
+    """
+    with open(filepath, 'r') as file:
+        tree = ast.parse(file.read())
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            return node.name
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            return node.name
+    return None
+
+def get_discovery_cache_file(directory):
+    """
+    The suggested location of the discovery cache of a folder: next to the folder, for example 
+    documents.class_names.json for the folder documents.
+    """
+    return os.path.abspath(directory).rstrip(os.sep) + ".class_names.json"
+
+def _read_discovery_cache(cache_file):
+    if not cache_file or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r') as file:
+            cache = json.load(file)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring the discovery cache {cache_file} because it could not be read: {e}")
+        return {}
+    if cache.get("version") != DISCOVERY_CACHE_VERSION:
+        return {}
+    return cache.get("files", {})
+
+def _write_discovery_cache(cache_file, files):
+    # written to a temporary file that replaces the cache so a process never reads a partly written cache
+    temporary_file = None
+    try:
+        descriptor, temporary_file = tempfile.mkstemp(prefix=os.path.basename(cache_file) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(cache_file)))
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump({"version": DISCOVERY_CACHE_VERSION, "files": files}, file, indent=1)
+        os.replace(temporary_file, cache_file)
+    except OSError as e:
+        if temporary_file and os.path.exists(temporary_file):
+            os.remove(temporary_file)
+        if cache_file in _unwritable_discovery_caches:
+            logger.log(DEV_LEVEL, f"Unable to save the discovery cache {cache_file}: {e}")
+        else:
+            _unwritable_discovery_caches.add(cache_file)
+            logger.warning(f"Unable to save the discovery cache {cache_file}: {e}")
+
+def find_class_names_in_files(directory, cache_file=None, max_workers=None):
     """
     Extracts the first class name from each Python file in a directory.
 
+    If cache_file is provided (for example get_discovery_cache_file(directory)), the class names are saved in that
+    discovery cache keyed on the file name, modification time and size so only new or changed files are parsed. If 
+    there are many of those, they are parsed in parallel.
+
     Args:
     directory (str): The directory to search for Python files.
+    cache_file (str): The discovery cache. None (the default) does not use a cache.
+    max_workers (int): The number of processes used to parse the files that are not in the cache.
 
     Returns:
     dict: A dictionary where keys are the filenames without extensions and values are the class names found in the files.
     """
-    class_dict = {}
+    cached_files = _read_discovery_cache(cache_file)
+
+    files = {}
+    misses = []
     for filename in os.listdir(directory):
         if filename.endswith(".py"):
-            filepath = os.path.join(directory, filename)
-            with open(filepath, 'r') as file:
-                file_content = file.read()
-            tree = ast.parse(file_content)
-            for node in ast.walk(tree):
-                if isinstance(node, ast.ClassDef):
-                    class_name = node.name
-                    file_name_without_extension = os.path.splitext(filename)[0]
-                    class_dict[file_name_without_extension] = class_name
-                    break
+            stat = os.stat(os.path.join(directory, filename))
+            cached = cached_files.get(filename)
+            if cached and cached["mtime_ns"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+                files[filename] = cached
+            else:
+                files[filename] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "class_name": None}
+                misses.append(filename)
+
+    if misses:
+        filepaths = [os.path.join(directory, filename) for filename in misses]
+        if len(misses) >= MIN_FILES_FOR_PARALLEL_DISCOVERY and max_workers != 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                class_names = list(executor.map(first_class_name_in_file, filepaths))
+        else:
+            class_names = [first_class_name_in_file(filepath) for filepath in filepaths]
+        for filename, class_name in zip(misses, class_names):
+            files[filename]["class_name"] = class_name
+        logger.log(DEV_LEVEL, f"Parsed {len(misses)} of the {len(files)} python files in {directory}")
+    
+    if cache_file and (misses or len(files) != len(cached_files)):
+        _write_discovery_cache(cache_file, files)
+
+    class_dict = {}
+    for filename, entry in files.items():
+        if entry["class_name"]:
+            class_dict[os.path.splitext(filename)[0]] = entry["class_name"]
     return class_dict
 
 def get_document_class_by_name(class_name, namespace_dict=None):
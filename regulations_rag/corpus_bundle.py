@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import struct
+import pandas as pd
+import pyarrow as pa
+from regulations_rag.file_tools import frame_from_table, table_from_frame
+from regulations_rag.regulation_table_of_content import StandardTableOfContent
+from regulations_rag.section_store import DEFAULT_RENDER_FLAGS, SectionStore, build_section_store
+from regulations_rag.toc_snapshot import document_source_hash, reference_checker_signature, toc_to_frame
+
+logger = logging.getLogger(__name__)
+DEV_LEVEL = 15
+logging.addLevelName(DEV_LEVEL, 'DEV')
+
+# The layout of a bundle is:
+#   BUNDLE_MAGIC | manifest length (unsigned 64 bit, little endian) | manifest (json) | padding | section | padding | ...
+# Each section is an Arrow IPC file that starts on a multiple of BUNDLE_ALIGNMENT bytes so it can be read from a memory
+# map without copying. The manifest holds the offset (from the start of the first section), length and metadata of
+# each section.
+BUNDLE_MAGIC = b"RAGBNDL\x00"
+BUNDLE_VERSION = 3
+BUNDLE_ALIGNMENT = 64
+INDEX_SECTIONS = ["definitions", "index", "workflow"]
+
+
+def _aligned(length):
+    return (length + BUNDLE_ALIGNMENT - 1) // BUNDLE_ALIGNMENT * BUNDLE_ALIGNMENT
+
+
+def _serialize(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def save_corpus_bundle(path_to_file, corpus, definitions=None, index=None, workflow=None, render_flags=DEFAULT_RENDER_FLAGS):
+    """
+    Packs everything a corpus and its DataFrameCorpusIndex derive from their source at runtime into one file: for each 
+    document, the table of content and the sections rendered by build_section_store(...), and the definitions, index 
+    and workflow DataFrames (with their embeddings as a matrix). Everything is stored as Arrow data.
+
+    The table of content is only stored if it is a StandardTableOfContent built with the document's reference_checker
+    because CorpusBundle.get_toc(...) rebuilds one with that checker. Other documents build their own.
+
+    Parameters:
+    - path_to_file (str): The bundle to write.
+    - corpus (Corpus): The documents to pack. The key of each document in the corpus is used in the bundle.
+    - definitions, index, workflow (pd.DataFrame, optional): The DataFrames of a DataFrameCorpusIndex.
+    - render_flags (list): The (add_markdown_decorators, add_headings, section_only) combinations to render.
+    """
+    sections = []
+    for document_key in corpus.all_documents:
+        document = corpus.get_document(document_key)
+        toc = document.get_cached_toc()
+        source_hash = document_source_hash(document)
+        if type(toc) is StandardTableOfContent and toc.reference_checker is document.reference_checker:
+            toc_metadata = {"source_hash": source_hash, 
+                            "reference_checker": reference_checker_signature(toc.reference_checker),
+                            "root_name": toc.root.name, 
+                            "root_heading_text": toc.root.heading_text}
+            sections.append((f"documents/{document_key}/toc", pa.Table.from_pandas(toc_to_frame(toc), preserve_index=False), toc_metadata))
+        sections.append((f"documents/{document_key}/sections", table_from_frame(build_section_store(document, render_flags), preserve_index=False), {"source_hash": source_hash}))
+    for name, df in zip(INDEX_SECTIONS, [definitions, index, workflow]):
+        if df is not None:
+            sections.append((f"index/{name}", table_from_frame(df, preserve_index=False), {}))
+
+    manifest = {"version": BUNDLE_VERSION, "sections": {}}
+    blobs = []
+    offset = 0
+    for name, table, metadata in sections:
+        blob = _serialize(table)
+        manifest["sections"][name] = {"offset": offset, "length": blob.size, "metadata": metadata}
+        blobs.append(blob)
+        offset = _aligned(offset + blob.size)
+
+    manifest_bytes = json.dumps(manifest).encode()
+    header = BUNDLE_MAGIC + struct.pack("<Q", len(manifest_bytes)) + manifest_bytes
+    with open(path_to_file, "wb") as file:
+        file.write(header + b"\x00" * (_aligned(len(header)) - len(header)))
+        for blob in blobs:
+            file.write(blob)
+            file.write(b"\x00" * (_aligned(blob.size) - blob.size))
+    logger.log(DEV_LEVEL, f"Saved {len(sections)} sections in the corpus bundle {path_to_file}")
+
+
+class CorpusBundle:
+    """
+    Reads a file written by save_corpus_bundle(...). The file is memory mapped and each section is read from the map
+    without copying so processes that open the same bundle share the pages in the operating system's cache.
+
+    Documents are always built by their own constructor. A document then gets its rendered sections and table of 
+    content from the bundle with apply_to_document(...) if it has the same 
+    regulations_rag.toc_snapshot.document_source_hash(...) as when the bundle was written, so a change to the 
+    document's source (for example its CSV file) or its class means the bundle is not used for it.
+    """
+    def __init__(self, path_to_file):
+        if not os.path.exists(path_to_file):
+            msg = f"Could not find the file {path_to_file}"
+            logger.error(msg)
+            raise FileNotFoundError(msg)
+        self.path_to_file = path_to_file
+        self._buffer = pa.memory_map(path_to_file, "r").read_buffer()
+        magic_length = len(BUNDLE_MAGIC)
+        if self._buffer.size < magic_length + 8 or self._buffer[:magic_length].to_pybytes() != BUNDLE_MAGIC:
+            msg = f"The file {path_to_file} is not a corpus bundle"
+            logger.error(msg)
+            raise ValueError(msg)
+        (manifest_length,) = struct.unpack("<Q", self._buffer[magic_length:magic_length + 8].to_pybytes())
+        header_length = magic_length + 8 + manifest_length
+        manifest = json.loads(self._buffer[magic_length + 8:header_length].to_pybytes())
+        if manifest.get("version") != BUNDLE_VERSION:
+            msg = f"The corpus bundle {path_to_file} has version {manifest.get('version')}, expected {BUNDLE_VERSION}"
+            logger.error(msg)
+            raise ValueError(msg)
+        self._sections = manifest["sections"]
+        self._data_offset = _aligned(header_length)
+
+    def section_names(self):
+        return list(self._sections.keys())
+
+    def has_section(self, name):
+        return name in self._sections
+
+    def get_metadata(self, name):
+        return self._sections[name]["metadata"]
+
+    def read_table(self, name):
+        section = self._sections[name]
+        blob = self._buffer.slice(self._data_offset + section["offset"], section["length"])
+        return pa.ipc.open_file(blob).read_all()
+
+    def read_frame(self, name):
+        return frame_from_table(self.read_table(name))
+
+    def get_section_store(self, document_key):
+        name = f"documents/{document_key}/sections"
+        if not self.has_section(name):
+            return None
+        section_store = SectionStore.from_table(self.read_table(name))
+        section_store.source_hash = self.get_metadata(name)["source_hash"]
+        return section_store
+
+    def get_toc(self, document_key, document):
+        """
+        Rebuilds the document's table of content with its reference_checker or returns None if it is not in the bundle.
+        """
+        name = f"documents/{document_key}/toc"
+        if not self.has_section(name):
+            return None
+        metadata = self.get_metadata(name)
+        if metadata["reference_checker"] != reference_checker_signature(document.reference_checker):
+            return None
+        toc = StandardTableOfContent.from_nodes(metadata["root_name"], document.reference_checker, document.document_as_df, self.read_frame(name))
+        toc.root.heading_text = metadata["root_heading_text"]
+        return toc
+
+    def get_toc_references(self, document_key):
+        """
+        Returns the references in the document's table of content (in pre-order) without rebuilding it, or None if it
+        is not in the bundle.
+        """
+        name = f"documents/{document_key}/toc"
+        return self.read_table(name).column("full_node_name").to_pylist() if self.has_section(name) else None
+
+    def apply_to_document(self, document_key, document):
+        """
+        Gives the document its rendered sections and table of content from the bundle.
+
+        Returns:
+            bool: False if the bundle does not have the document or it was written from a different version of it.
+        """
+        name = f"documents/{document_key}/sections"
+        if not self.has_section(name):
+            return False
+        if self.get_metadata(name)["source_hash"] != document_source_hash(document):
+            logger.warning(f"The corpus bundle {self.path_to_file} is out of date for {document_key} so it will not be used")
+            return False
+        document._cached_toc = self.get_toc(document_key, document)
+        document.section_store = self.get_section_store(document_key)
+        return True
+
+    def get_index_frames(self):
+        """
+        Returns the definitions, index and workflow DataFrames (empty if they are not in the bundle).
+        """
+        frames = []
+        for name in INDEX_SECTIONS:
+            frames.append(self.read_frame(f"index/{name}") if self.has_section(f"index/{name}") else pd.DataFrame())
+        return tuple(frames)
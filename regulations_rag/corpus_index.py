@@ -2,7 +2,9 @@ import logging
 from abc import ABC, abstractmethod
 import pandas as pd
 from regulations_rag.rerank import RerankAlgos, rerank
-from regulations_rag.embeddings import get_closest_nodes, num_tokens_from_string
+from regulations_rag.embeddings import get_closest_nodes
+from regulations_rag.term_scanner import CorpusScanner
+from regulations_rag.corpus_bundle import CorpusBundle
 
 # Create a logger for this module
 logger = logging.getLogger(__name__)
@@ -98,8 +100,11 @@ class CorpusIndex(ABC):
 class DataFrameCorpusIndex(CorpusIndex):
     """
     An instance of the Corpus Index if the data is contained in DataFrames rather than Databases.
+
+    If the 'text' columns of the definitions, index and workflow were loaded encrypted, pass a 
+    regulations_rag.file_tools.LazyTextDecryptor as text_decryptor and only the rows that are returned are decrypted.
     """
-    def __init__(self, user_type, corpus_description, corpus, definitions, index, workflow):
+    def __init__(self, user_type, corpus_description, corpus, definitions, index, workflow, text_decryptor=None):
         columns_in_dfns = ["embedding", "document", "section_reference", "text", "definition"]
         for column in columns_in_dfns:
             assert column in definitions.columns.to_list()
@@ -116,9 +121,49 @@ class DataFrameCorpusIndex(CorpusIndex):
         self.definitions = definitions
         self.index = index
         self.workflow = workflow
+        self.text_decryptor = text_decryptor
+        self._scanner = None
+
+    def _decrypt_text(self, df):
+        """
+        Replaces the encrypted 'text' column of the rows in df with plain text if the index has a text_decryptor.
+        """
+        if self.text_decryptor is None or df.empty or "text" not in df.columns:
+            return df
+        df = df.copy()
+        df["text"] = self.text_decryptor.decrypt_many(df["text"].to_list())
+        return df
+
+    @classmethod
+    def from_bundle(cls, user_type, corpus_description, corpus, bundle):
+        """
+        Creates the index from the definitions, index and workflow DataFrames in a corpus bundle (a CorpusBundle or 
+        the path to one) rather than from separate files. See regulations_rag.corpus_bundle.
+        """
+        if isinstance(bundle, str):
+            bundle = CorpusBundle(bundle)
+        definitions, index, workflow = bundle.get_index_frames()
+        return cls(user_type, corpus_description, corpus, definitions, index, workflow)
+
+    def get_scanner(self):
+        """
+        Returns a CorpusScanner over the references in the corpus and the terms in the definitions. It is built on 
+        first use.
+        """
+        if self._scanner is None:
+            self._scanner = CorpusScanner(corpus=self.corpus, definitions=self.definitions)
+        return self._scanner
+
+    def get_definitions_in_text(self, text):
+        """
+        Returns the definitions whose defined term appears in text (for example a retrieved section) without using 
+        the embeddings.
+        """
+        return self._decrypt_text(self.get_scanner().find_definitions(text))
 
     def get_relevant_definitions(self, user_content, user_content_embedding, threshold):
         relevant_definitions = get_closest_nodes(self.definitions, embedding_column_name="embedding", content_embedding=user_content_embedding, threshold=threshold)
+        relevant_definitions = self._decrypt_text(relevant_definitions)
 
         if not relevant_definitions.empty:
             logger.log(DEV_LEVEL, "--   Relevant Definitions")
@@ -135,7 +180,7 @@ class DataFrameCorpusIndex(CorpusIndex):
         for index, row in relevant_sections.iterrows():
             text = self.corpus.get_text(row["document"], row["section_reference"])
             relevant_sections.loc[index, "regulation_text"] = text
-            relevant_sections.loc[index, "token_count"] = num_tokens_from_string(text)
+            relevant_sections.loc[index, "token_count"] = self.corpus.get_token_count(row["document"], row["section_reference"])
 
         cumulative_sum = 0
         counter = 0
@@ -185,7 +230,7 @@ class DataFrameCorpusIndex(CorpusIndex):
         """
         relevant_sections = get_closest_nodes(self.index, embedding_column_name="embedding", content_embedding=user_content_embedding, threshold=threshold)         
         n = rerank_algo.params["initial_section_number_cap"]
-        relevant_sections = relevant_sections.nsmallest(n, 'cosine_distance')      
+        relevant_sections = self._decrypt_text(relevant_sections.nsmallest(n, 'cosine_distance'))
         logger.log(DEV_LEVEL, f"Selecting the top {n} items based on cosine-similarity score")
         for index, row in relevant_sections.iterrows():
             logger.log(DEV_LEVEL, f'{row["cosine_distance"]:.4f}: {row["document"]:>20}: {row["section_reference"]:>20}: {row["source"]:>15}: {row["text"]}')
@@ -232,6 +277,6 @@ class DataFrameCorpusIndex(CorpusIndex):
             Returns an empty DataFrame if no workflow information is available.
         """
         if len(self.workflow) > 0:
-            return get_closest_nodes(self.workflow, embedding_column_name="embedding", content_embedding=user_content_embedding, threshold=threshold)
+            return self._decrypt_text(get_closest_nodes(self.workflow, embedding_column_name="embedding", content_embedding=user_content_embedding, threshold=threshold))
         else:
             return pd.DataFrame([], columns=self.required_columns_workflow)
@@ -1,15 +1,120 @@
+import logging
 import os
 import re
 import pandas as pd
 from abc import ABC, abstractmethod
 from regulations_rag.reference_checker import ReferenceChecker
+from regulations_rag.regulation_table_of_content import StandardTableOfContent
+from regulations_rag.section_store import SectionStore
+from regulations_rag.toc_snapshot import document_source_hash, load_toc_snapshot, save_toc_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Footnotes are on their own line in the text column, for example "[^1]: The footnote text"
+FOOTNOTE_PATTERN = re.compile(r'^\[\^\d+\]\:')
+
+
+class DocumentRow:
+    """
+    A single line of a document. The footnotes are separated from the text when the document is loaded.
+
+    Rows support item access (row["heading"]) so they can be used wherever a row of document_as_df was used.
+    """
+    __slots__ = ("section_reference", "heading", "text", "footnotes")
+
+    def __init__(self, section_reference, heading, text, footnotes):
+        self.section_reference = section_reference
+        self.heading = heading
+        self.text = text
+        self.footnotes = footnotes
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class DocumentRows:
+    """
+    A compact, read only version of a document's 'section_reference', 'heading' and 'text' columns used for rendering.
+
+    The columns are kept as parallel Python lists (with the footnotes in their own list) and each row is also 
+    available as a DocumentRow, both in document order and grouped by section_reference, so rendering iterates plain 
+    sequences instead of DataFrame rows. document_as_df remains the public version of the document.
+    """
+    def __init__(self, section_references, headings, texts, footnotes):
+        self.section_references = section_references
+        self.headings = headings
+        self.texts = texts
+        self.footnotes = footnotes
+        self.rows = [DocumentRow(*values) for values in zip(section_references, headings, texts, footnotes)]
+        self.rows_by_reference = {}
+        for row in self.rows:
+            self.rows_by_reference.setdefault(row.section_reference, []).append(row)
+
+    @classmethod
+    def from_dataframe(cls, df, extract_footnotes):
+        """
+        Builds the rows from a DataFrame with the columns 'section_reference', 'heading' and 'text'. Returns None if the
+        DataFrame does not use these standard columns.
+
+        Parameters:
+            df (pd.DataFrame): The document.
+            extract_footnotes (callable): Splits text into (footnotes, remaining text) - see Document._extract_footnotes.
+        """
+        if df is None or not all(col in df.columns for col in ["section_reference", "heading", "text"]):
+            return None
+
+        texts, footnotes = [], []
+        for text in df["text"].to_list():
+            if isinstance(text, str) and "[^" in text:
+                row_footnotes, row_text = extract_footnotes(text, FOOTNOTE_PATTERN)
+            else:
+                row_footnotes, row_text = [], text
+            texts.append(row_text)
+            footnotes.append(tuple(row_footnotes))
+
+        return cls(df["section_reference"].to_list(), [bool(heading) for heading in df["heading"].to_list()], texts, footnotes)
+
+    def get_rows(self, section_reference):
+        return self.rows_by_reference.get(section_reference, [])
+
+    def __contains__(self, section_reference):
+        return section_reference in self.rows_by_reference
+
+    def __len__(self):
+        return len(self.rows)
 
 
 class Document(ABC):
+    # Optional SectionStore with text rendered at build time (see regulations_rag.section_store)
+    section_store = None
+    # Optional folder for table of content snapshots (see regulations_rag.toc_snapshot and get_cached_toc())
+    toc_cache_folder = None
+
     def __init__(self, document_name, reference_checker):
         self.name = document_name
         self.reference_checker = reference_checker
 
+    @property
+    def document_as_df(self):
+        return self._document_as_df
+
+    @document_as_df.setter
+    def document_as_df(self, df):
+        # Implementing classes set document_as_df either before or after calling Document.__init__(...) so anything
+        # derived from the DataFrame is reset here rather than in the constructor
+        self._document_as_df = df
+        self._reset_document_caches()
+
+    def _reset_document_caches(self):
+        """
+        Clears and rebuilds everything that is derived from document_as_df. This is called automatically when 
+        document_as_df is (re)assigned but needs to be called explicitly if the DataFrame is modified in place.
+        """
+        self._ancestor_heading_cache = {}
+        self._cached_toc = None
+        self.section_store = None
+        self._rows = DocumentRows.from_dataframe(self._document_as_df, self._extract_footnotes)
+
     @abstractmethod
     def get_text(self, section_reference, add_markdown_decorators=True, add_headings=True, section_only=False):
         """
@@ -24,13 +129,76 @@ class Document(ABC):
         """Abstract method to get the table of contents of the document."""
         pass
 
+    def get_cached_toc(self):
+        """
+        Returns the table of content from get_toc(), building it at most once for each version of document_as_df.
+
+        If toc_cache_folder is set, the table of content is loaded from a snapshot in that folder when the snapshot
+        was built from the same document (see regulations_rag.toc_snapshot.document_source_hash(...)). Otherwise it is
+        built with get_toc() and, if it is a StandardTableOfContent that uses the document's reference_checker, the 
+        snapshot is (re)written so the next process can skip building it. Documents whose get_toc() uses another table
+        of content class or its own reference checker always build it.
+        """
+        if getattr(self, "_cached_toc", None) is not None:
+            return self._cached_toc
+
+        if not self.toc_cache_folder:
+            self._cached_toc = self.get_toc()
+            return self._cached_toc
+
+        path_to_snapshot = os.path.join(self.toc_cache_folder, f"{type(self).__name__}.toc.parquet")
+        source_hash = document_source_hash(self)
+        toc = load_toc_snapshot(path_to_snapshot, self.reference_checker, source_hash, regulation_df=self.document_as_df)
+        if toc is None:
+            toc = self.get_toc()
+            if type(toc) is StandardTableOfContent and toc.reference_checker is self.reference_checker:
+                try:
+                    os.makedirs(self.toc_cache_folder, exist_ok=True)
+                    save_toc_snapshot(toc, path_to_snapshot, source_hash)
+                except OSError as e:
+                    logger.warning(f"Unable to save the table of content snapshot {path_to_snapshot}: {e}")
+        self._cached_toc = toc
+        return self._cached_toc
+
+    def load_section_store(self, path_to_file):
+        """
+        Loads the sections rendered at build time by regulations_rag.section_store.build_section_store(...) so that
+        get_stored_text(...) can serve them without any string assembly. The store is ignored (and a warning logged)
+        if it was not built from the current version of the document (see 
+        regulations_rag.toc_snapshot.document_source_hash(...)). The store is dropped when document_as_df is reassigned.
+
+        Returns:
+        bool: True if the store was loaded.
+        """
+        section_store = SectionStore.from_file(path_to_file)
+        if section_store.source_hash != document_source_hash(self):
+            logger.warning(f"The section store {path_to_file} was not built from the current version of {self.name} so it will not be used")
+            self.section_store = None
+            return False
+        self.section_store = section_store
+        return True
+
+    def get_stored_text(self, section_reference, add_markdown_decorators=True, add_headings=True, section_only=False):
+        """
+        Returns the pre-rendered text for the section or None if there is no section store or the section (in this
+        combination of flags) was not rendered at build time.
+        """
+        if self.section_store is None:
+            return None
+        return self.section_store.get_text(section_reference, add_markdown_decorators, add_headings, section_only)
+
+    def get_stored_token_count(self, section_reference, add_markdown_decorators=True, add_headings=True, section_only=False):
+        if self.section_store is None:
+            return None
+        return self.section_store.get_token_count(section_reference, add_markdown_decorators, add_headings, section_only)
+
     def _extract_footnotes(self, text, footnote_pattern):
         """
         Extract footnotes from the text based on the provided footnote pattern.
 
         Args:
             text (str): The text from which footnotes need to be extracted.
-            footnote_pattern (str): The regex pattern to identify footnotes.
+            footnote_pattern (str or re.Pattern): The regex pattern to identify footnotes.
 
         Returns:
             tuple: A tuple containing a list of footnotes and the remaining text.
@@ -85,38 +253,34 @@ class Document(ABC):
         if section_reference and not self.reference_checker.is_valid(section_reference):
             return "", []
 
-        footnote_pattern = r'^\[\^\d+\]\:'
-        text, all_footnotes = "", []
+        all_footnotes = []
 
-        subset = self.document_as_df if not section_reference else self.document_as_df[self.document_as_df["section_reference"] == section_reference]
+        rows = self._rows.rows if not section_reference else self._rows.get_rows(section_reference)
 
-        if subset.empty:
+        if not rows:
             return "", []
 
-        for _, row in subset.iterrows():
-            footnotes, text_extract = self._extract_footnotes(row["text"], footnote_pattern)
-            all_footnotes.extend(footnotes)
-            text += self._format_line(row, text_extract.strip(), add_markdown_decorators)
-            if text.strip().endswith("|") and not text_extract.strip().startswith("|"):
-                text += "\n"
+        lines, ends_with_table = [], False
+        for row in rows:
+            text_extract = row.text.strip()
+            all_footnotes.extend(row.footnotes)
+            line = self._format_line(row, text_extract, add_markdown_decorators)
+            lines.append(line)
+            # tables need a blank line after them unless the next line continues the table
+            stripped_line = line.rstrip()
+            if stripped_line:
+                ends_with_table = stripped_line.endswith("|")
+            if ends_with_table and not text_extract.startswith("|"):
+                lines.append("\n")
+        text = "".join(lines)
 
         if add_headings:
-            build_up, buildup_footnotes = "", []
-            parent = self.reference_checker.get_parent_reference(section_reference)
-            while parent:
-                subset = self.document_as_df[self.document_as_df["section_reference"] == parent]
-                for _, row in subset.iloc[::-1].iterrows():
-                    if row["heading"]:
-                        footnotes, text_extract = self._extract_footnotes(row["text"], footnote_pattern)
-                        buildup_footnotes.extend(footnotes)
-                        build_up = self._format_line(row, text_extract.strip(), add_markdown_decorators) + build_up
-                parent = self.reference_checker.get_parent_reference(parent)
-
+            build_up, buildup_footnotes = self._get_ancestor_headings(section_reference, add_markdown_decorators)
             text = build_up + text
-            all_footnotes = buildup_footnotes + all_footnotes
+            all_footnotes = list(buildup_footnotes) + all_footnotes
 
         if section_reference and not section_only:
-            toc = self.get_toc()
+            toc = self.get_cached_toc()
             children_nodes = toc.get_node(section_reference).children
             for child_node in children_nodes:
                 child_section_reference = child_node.full_node_name
@@ -146,6 +310,45 @@ class Document(ABC):
         return formatted_text.strip()
 
 
+    def _get_section_headings(self, section_reference, add_markdown_decorators):
+        """
+        Formats the heading rows of a single section (excluding its parents).
+
+        Returns:
+            tuple: The formatted heading text and a tuple of the footnotes in the heading rows. The footnotes are 
+                   listed from the last row to the first which is the order in which get_text_and_footnotes(...) has
+                   always listed the footnotes of parent headings.
+        """
+        heading_text, heading_footnotes = "", []
+        for row in reversed(self._rows.get_rows(section_reference)):
+            if row.heading:
+                heading_footnotes.extend(row.footnotes)
+                heading_text = self._format_line(row, row.text.strip(), add_markdown_decorators) + heading_text
+        return heading_text, tuple(heading_footnotes)
+
+    def _get_ancestor_headings(self, section_reference, add_markdown_decorators):
+        """
+        Returns the formatted headings of all the parents of section_reference (root first) and their footnotes.
+
+        The result is memoised for each (section_reference, add_markdown_decorators) pair and is built from the 
+        memoised result of the parent so sibling sections share the work of walking up to the root.
+        """
+        key = (section_reference, add_markdown_decorators)
+        cached = self._ancestor_heading_cache.get(key)
+        if cached is not None:
+            return cached
+
+        parent = self.reference_checker.get_parent_reference(section_reference)
+        if parent:
+            parent_heading, parent_footnotes = self._get_section_headings(parent, add_markdown_decorators)
+            ancestor_heading, ancestor_footnotes = self._get_ancestor_headings(parent, add_markdown_decorators)
+            result = (ancestor_heading + parent_heading, parent_footnotes + ancestor_footnotes)
+        else:
+            result = ("", ())
+
+        self._ancestor_heading_cache[key] = result
+        return result
+
     def get_heading(self, section_reference, add_markdown_decorators=False):
         """
         Get the heading text for a given section reference.
@@ -157,35 +360,13 @@ class Document(ABC):
         Returns:
             str: The heading text.
         """
-        footnote_pattern = r'^\[\^\d+\]\:'
         if not self.reference_checker.is_valid(section_reference):
             return ""
 
-        text, all_footnotes = "", []
-        subset = self.document_as_df[self.document_as_df["section_reference"] == section_reference]
-
-        if not subset.empty:
-            for _, row in subset.iterrows():
-                if row["heading"]:
-                    footnotes, text_extract = self._extract_footnotes(row["text"], footnote_pattern)
-                    formatted_text = self._format_line(row, text_extract.strip(), add_markdown_decorators)
-                    if formatted_text:
-                        all_footnotes.extend(footnotes)
-                        text += formatted_text
-
-            parent = self.reference_checker.get_parent_reference(section_reference)
-            build_up = ""
-            while parent:
-                subset = self.document_as_df[self.document_as_df["section_reference"] == parent]
-                for _, row in subset.iloc[::-1].iterrows():
-                    if row["heading"]:
-                        footnotes, text_extract = self._extract_footnotes(row["text"], footnote_pattern)
-                        formatted_text = self._format_line(row, text_extract.strip(), add_markdown_decorators)
-                        if formatted_text:
-                            all_footnotes.extend(footnotes)
-                            build_up = formatted_text + build_up
-                parent = self.reference_checker.get_parent_reference(parent)
-
-            text = build_up + text
+        text = ""
+        if section_reference in self._rows:
+            section_heading, _ = self._get_section_headings(section_reference, add_markdown_decorators)
+            build_up, _ = self._get_ancestor_headings(section_reference, add_markdown_decorators)
+            text = build_up + section_heading
 
         return text.strip("\n")
\ No newline at end of file
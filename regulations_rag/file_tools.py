@@ -1,6 +1,14 @@
+import functools
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from cryptography.fernet import Fernet
 
 
@@ -12,45 +20,355 @@ ANALYSIS_LEVEL = 25
 logging.addLevelName(DEV_LEVEL, 'DEV')       
 logging.addLevelName(ANALYSIS_LEVEL, 'ANALYSIS')       
 
-def load_parquet_data(path_to_file, decryption_key = ""):
+# The types of the standard columns of a manual when it is read from a CSV file. Other columns are inferred.
+CSV_COLUMN_TYPES = {
+    "indent": pa.int64(),
+    "reference": pa.string(),
+    "text": pa.string(),
+    "document": pa.string(),
+    "page": pa.string(),
+    "heading": pa.bool_(),
+    "section_reference": pa.string(),
+    "word_count": pa.int64(),
+    "sections_referenced": pa.string(),
+}
+# The values accepted in boolean columns, like pandas. A blank boolean cell is read as False.
+CSV_TRUE_VALUES = ["True", "true", "TRUE", "1"]
+CSV_FALSE_VALUES = ["False", "false", "FALSE", "0"]
+# The number of bytes of a CSV file in each DataFrame yielded by iter_csv_data(...)
+CSV_BLOCK_SIZE = 64 * 1024 * 1024
+
+# The number of rows decrypted by each task when decrypt_text(...) is given more than one worker. Columns with fewer 
+# rows are decrypted in this process.
+DECRYPTION_CHUNK_SIZE = 2000
+
+def _decrypt_chunk(decryption_key, tokens):
+    fernet = Fernet(decryption_key)
+    return [fernet.decrypt(token.encode()).decode() for token in tokens]
+
+def _encrypt_chunk(decryption_key, text):
+    fernet = Fernet(decryption_key)
+    return [fernet.encrypt(line.encode()).decode() for line in text]
+
+def _apply_in_chunks(function, values, decryption_key, max_workers, chunk_size, description):
+    values = list(values)
+    if max_workers is None or max_workers <= 1 or len(values) <= chunk_size:
+        return function(decryption_key, values)
+
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    results = [None] * len(chunks)
+    completed_rows = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(function, decryption_key, chunk): i for i, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            completed_rows += len(results[i])
+            logger.log(DEV_LEVEL, f"{description} {completed_rows} of {len(values)} rows")
+    return [value for chunk in results for value in chunk]
+
+def encrypt_text(text, decryption_key, max_workers=None, chunk_size=DECRYPTION_CHUNK_SIZE):
+    """
+    Encrypts a list of strings with Fernet. Works in the same way as decrypt_text(...).
+    """
+    return _apply_in_chunks(_encrypt_chunk, text, decryption_key, max_workers, chunk_size, "Encrypted")
+
+def decrypt_text(tokens, decryption_key, max_workers=None, chunk_size=DECRYPTION_CHUNK_SIZE):
+    """
+    Decrypts a list of Fernet tokens. By default this happens in the calling process. If max_workers is more than 1,
+    large lists are split into chunks that are decrypted in a process pool (which receives the key) and put back 
+    together in their original order. Progress is logged at the DEV level.
+
+    Parameters:
+    -----------
+    tokens : list
+        The encrypted strings.
+    decryption_key : str
+        The Fernet key.
+    max_workers : int, optional
+        The number of worker processes. None or 1 (the default) decrypts everything in this process.
+    chunk_size : int, optional
+        The number of tokens in each task.
+
+    Returns:
+    --------
+    list
+        The decrypted strings in the same order as tokens.
+    """
+    return _apply_in_chunks(_decrypt_chunk, tokens, decryption_key, max_workers, chunk_size, "Decrypted")
+
+class LazyTextDecryptor:
+    """
+    Decrypts Fernet tokens on demand, keeping the most recently used plaintexts in a small LRU cache.
+
+    Use it to leave the 'text' column encrypted at load time (call load_parquet_data(...) without the key) and only
+    decrypt the rows that are returned to the user or sent to the LLM, for example by passing it to 
+    DataFrameCorpusIndex as the text_decryptor.
+
+    Parameters:
+    -----------
+    decryption_key : str
+        The Fernet key.
+    cache_size : int, optional
+        The maximum number of plaintexts held in the cache.
+    """
+    def __init__(self, decryption_key, cache_size=1024):
+        self._fernet = Fernet(decryption_key)
+        self._decrypt_cached = functools.lru_cache(maxsize=cache_size)(self._decrypt)
+
+    def _decrypt(self, token):
+        return self._fernet.decrypt(token.encode()).decode()
+
+    def decrypt(self, token):
+        return self._decrypt_cached(token)
+
+    def decrypt_many(self, tokens):
+        return [self._decrypt_cached(token) for token in tokens]
+
+    def cache_info(self):
+        return self._decrypt_cached.cache_info()
+
+    def cache_clear(self):
+        self._decrypt_cached.cache_clear()
+
+EMBEDDING_COLUMN = "embedding"
+
+def embeddings_to_arrow(vectors, dtype=np.float32):
+    """
+    Converts a column of embeddings to an Arrow FixedSizeList array backed by one contiguous buffer.
+
+    Parameters:
+    -----------
+    vectors : iterable
+        The embeddings (lists or 1-D arrays).
+    dtype : numpy dtype, optional
+        The type of the stored values. None keeps the type of the input.
+
+    Returns:
+    --------
+    pa.FixedSizeListArray or None
+        None if there are no embeddings or they don't all have the same length.
+    """
+    vectors = [np.asarray(vector) for vector in vectors]
+    if not vectors or any(vector.ndim != 1 for vector in vectors) or len({len(vector) for vector in vectors}) != 1:
+        return None
+    matrix = np.stack(vectors)
+    if dtype is not None:
+        matrix = matrix.astype(dtype, copy=False)
+    return pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel()), matrix.shape[1])
+
+def embedding_matrix_from_arrow(column):
+    """
+    Returns a column of embeddings as a 2-D numpy array without creating a Python object per value. Works for 
+    FixedSizeList columns (without copying) and for the variable length list columns in older files.
+
+    Returns:
+    --------
+    np.ndarray or None
+        None if the column is not a list column, has nulls or the embeddings don't all have the same length.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if len(column) == 0 or column.null_count:
+        return None
+    if pa.types.is_fixed_size_list(column.type):
+        width = column.type.list_size
+    elif pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+        lengths = np.diff(column.offsets.to_numpy())
+        if lengths.min() != lengths.max():
+            return None
+        width = int(lengths[0])
+    else:
+        return None
+    values = column.flatten()
+    if values.null_count:
+        return None
+    return values.to_numpy(zero_copy_only=False).reshape(len(column), width)
+
+def frame_from_table(table):
+    """
+    Converts an Arrow table to a DataFrame. The embeddings are rows of a single 2-D numpy array rather than separate
+    lists of Python floats.
+    """
+    if EMBEDDING_COLUMN in table.column_names:
+        matrix = embedding_matrix_from_arrow(table.column(EMBEDDING_COLUMN))
+        if matrix is not None:
+            df = table.drop_columns([EMBEDDING_COLUMN]).to_pandas()
+            df[EMBEDDING_COLUMN] = list(matrix)
+            return df[table.column_names]
+    return table.to_pandas()
+
+def table_from_frame(df, embedding_dtype=None, preserve_index=None):
+    """
+    Converts a DataFrame to an Arrow table, storing the embeddings as FixedSizeList<embedding_dtype>. An
+    embedding_dtype of None keeps the type of the embeddings. preserve_index is passed to pa.Table.from_pandas(...).
+    """
+    embeddings = embeddings_to_arrow(df[EMBEDDING_COLUMN].to_list(), embedding_dtype) if EMBEDDING_COLUMN in df.columns else None
+    if embeddings is None:
+        return pa.Table.from_pandas(df, preserve_index=preserve_index)
+    table = pa.Table.from_pandas(df.drop(columns=[EMBEDDING_COLUMN]), preserve_index=preserve_index)
+    position = df.columns.get_loc(EMBEDDING_COLUMN)
+    return table.add_column(position, EMBEDDING_COLUMN, embeddings)
+
+def load_embedding_matrix(path_to_file, column=EMBEDDING_COLUMN, filters=None):
+    """
+    Reads only the embeddings in a parquet file as a 2-D numpy array.
+    """
     if not os.path.exists(path_to_file):
         msg = f"Could not find the file {path_to_file}"
         logger.error(msg)
         raise FileNotFoundError(msg)
+    return embedding_matrix_from_arrow(pq.read_table(path_to_file, columns=[column], filters=filters).column(column))
 
-    df = pd.read_parquet(path_to_file, engine='pyarrow')
-    if decryption_key:
-        fernet = Fernet(decryption_key)
-        df['text'] = df['text'].apply(lambda x: fernet.decrypt(x.encode()).decode())
+def load_parquet_data(path_to_file, decryption_key = "", max_workers=None, columns=None, filters=None):
+    """
+    Loads a parquet file, decrypting the 'text' column if a decryption_key is provided.
+
+    Parameters:
+    -----------
+    path_to_file : str
+        The parquet file.
+    decryption_key : str, optional
+        The Fernet key used to encrypt the 'text' column.
+    max_workers : int, optional
+        The number of processes used to decrypt large files. By default the text is decrypted in this process. See 
+        decrypt_text(...).
+    columns : list, optional
+        Only read these columns.
+    filters : list, optional
+        Only read the rows that match these pyarrow filters, for example [("document", "in", {"WRR", "Plett"})] or
+        [("source", "==", "question")]. Row groups that can't match are skipped.
+    """
+    if not os.path.exists(path_to_file):
+        msg = f"Could not find the file {path_to_file}"
+        logger.error(msg)
+        raise FileNotFoundError(msg)
+
+    df = frame_from_table(pq.read_table(path_to_file, columns=columns, filters=filters))
+    if decryption_key and 'text' in df.columns:
+        df['text'] = decrypt_text(df['text'].to_list(), decryption_key, max_workers=max_workers)
+    return df
+
+def _with_common_embedding_type(schemas):
+    """
+    Files written before save_parquet_data(...) used FixedSizeList columns (or with a different embedding_dtype) 
+    store the embeddings with a different type, which pa.unify_schemas(...) can't merge. If the types differ, every 
+    file's embeddings are read as a variable length list of the widest value type.
+    """
+    fields = [schema.field(EMBEDDING_COLUMN) for schema in schemas if EMBEDDING_COLUMN in schema.names]
+    if len({field.type for field in fields}) < 2 or not all(pa.types.is_list(field.type) or pa.types.is_large_list(field.type) or pa.types.is_fixed_size_list(field.type) for field in fields):
+        return schemas
+    value_types = [field.type.value_type for field in fields]
+    value_type = max(value_types, key=lambda value_type: value_type.bit_width if pa.types.is_floating(value_type) else 0)
+    common_type = pa.list_(value_type)
+    return [schema.set(schema.get_field_index(EMBEDDING_COLUMN), schema.field(EMBEDDING_COLUMN).with_type(common_type)) if EMBEDDING_COLUMN in schema.names else schema for schema in schemas]
+
+def load_parquet_dataset(paths_to_files, decryption_key = "", max_workers=None, columns=None, filters=None):
+    """
+    Loads several parquet files (for example a file and its supplementary "_plus" file) as one pyarrow dataset. The
+    columns and filters are pushed down to each file and the files are only converted to a DataFrame once, rather 
+    than loading each one and concatenating them. Empty paths are ignored.
+
+    The columns of the result are the union of the columns in the files, like pd.concat(...). If the files store
+    their embeddings with different types (for example an older file with list<double> and a new one with 
+    FixedSizeList<float>) they are read with a common type that does not lose precision.
+
+    Parameters:
+    -----------
+    paths_to_files : list
+        The parquet files, in the order their rows should appear.
+    decryption_key, max_workers, columns, filters :
+        See load_parquet_data(...).
+    """
+    paths_to_files = [path_to_file for path_to_file in paths_to_files if path_to_file]
+    for path_to_file in paths_to_files:
+        if not os.path.exists(path_to_file):
+            msg = f"Could not find the file {path_to_file}"
+            logger.error(msg)
+            raise FileNotFoundError(msg)
+    if not paths_to_files:
+        return pd.DataFrame()
+
+    schema = pa.unify_schemas(_with_common_embedding_type([pq.read_schema(path_to_file).remove_metadata() for path_to_file in paths_to_files]))
+    dataset = ds.dataset(paths_to_files, schema=schema, format="parquet")
+    expression = pq.filters_to_expression(filters) if filters else None
+    df = frame_from_table(dataset.to_table(columns=columns, filter=expression))
+    if decryption_key and 'text' in df.columns:
+        df['text'] = decrypt_text(df['text'].to_list(), decryption_key, max_workers=max_workers)
     return df
 
-def save_parquet_data(df, path_to_file, decryption_key = ""):
+def save_parquet_data(df, path_to_file, decryption_key = "", embedding_dtype=None, max_workers=None):
+    """
+    Saves a DataFrame to an existing parquet file, encrypting the 'text' column if a decryption_key is provided. The
+    'embedding' column is stored as FixedSizeList<embedding_dtype> so it can be loaded as a single 2-D array. By 
+    default the embeddings keep their type. Pass embedding_dtype=np.float32 to halve the size of float64 embeddings 
+    at the cost of their precision.
+
+    The encrypted text is written from a separate Arrow table (encrypted in parallel chunks, see encrypt_text(...)) so
+    the caller's DataFrame is never changed, even if the write fails.
+    """
     if not os.path.exists(path_to_file):
         msg = f"Could not find the file {path_to_file}"
         logger.error(msg)
         raise FileNotFoundError(msg)
 
+    table = table_from_frame(df, embedding_dtype)
     if decryption_key:
-        fernet = Fernet(decryption_key)
-        df['text'] = df['text'].apply(lambda x: fernet.encrypt(x.encode()).decode())
-    df.to_parquet(path_to_file, engine = 'pyarrow')
-    # but leave the column unchanged in the input df so the user can continue to use it
-    if decryption_key:
-        df['text'] = df['text'].apply(lambda x: fernet.decrypt(x.encode()).decode())
+        encrypted_text = pa.array(encrypt_text(df['text'].to_list(), decryption_key, max_workers=max_workers), type=pa.string())
+        position = table.schema.get_field_index('text')
+        table = table.set_column(position, 'text', encrypted_text)
+    pq.write_table(table, path_to_file)
 
 
-def append_parquet_data(path_to_file, original_df, decryption_key = ""):
+def append_parquet_data(path_to_file, original_df, decryption_key = "", columns=None, filters=None):
     if path_to_file == "":
         return original_df
 
-    tmp = load_parquet_data(path_to_file, decryption_key)
+    tmp = load_parquet_data(path_to_file, decryption_key, columns=columns, filters=filters)
 
     return pd.concat([original_df, tmp], ignore_index = True)
 
 
+def _csv_column_names(path_to_file):
+    # utf-8-sig so a byte order mark is not read as part of the first column name
+    with open(path_to_file, "r", encoding="utf-8-sig") as file:
+        return file.readline().rstrip("\r\n").split("|")
+
+def _csv_read_options(path_to_file, block_size=None, string_columns=None):
+    """
+    The pyarrow options to read a pipe delimited manual. The columns in CSV_COLUMN_TYPES get their type from there,
+    the columns in string_columns are strings and other columns are inferred. Empty strings are kept as "" in string 
+    columns (like pandas with na_filter=False) but empty values in other columns are null so they are caught by the 
+    null check.
+    """
+    column_names = _csv_column_names(path_to_file)
+    column_types = {name: CSV_COLUMN_TYPES[name] for name in column_names if name in CSV_COLUMN_TYPES}
+    column_types.update({name: pa.string() for name in (string_columns or []) if name not in column_types})
+    read_options = pv.ReadOptions(encoding="utf8", block_size=block_size) if block_size else pv.ReadOptions(encoding="utf8")
+    parse_options = pv.ParseOptions(delimiter="|", newlines_in_values=True)
+    convert_options = pv.ConvertOptions(column_types=column_types, strings_can_be_null=False, true_values=CSV_TRUE_VALUES, false_values=CSV_FALSE_VALUES)
+    return read_options, parse_options, convert_options
+
+def _fill_blank_booleans(table):
+    for position, field in enumerate(table.schema):
+        if pa.types.is_boolean(field.type) and table.column(position).null_count > 0:
+            table = table.set_column(position, field, pc.fill_null(table.column(position), False))
+    return table
+
+def _check_csv_nulls(table, path_to_file):
+    columns_with_nulls = [name for name, column in zip(table.column_names, table.columns) if column.null_count > 0]
+    if columns_with_nulls:
+        msg = f'Encountered NaN values while loading {path_to_file}. This will cause ugly issues with the get_regulation_detail method'
+        logger.error(msg + f" (columns: {columns_with_nulls})")
+        raise ValueError(msg)
+
 def load_csv_data(path_to_file):
     """
-    Loads data from a CSV file, ensuring no NaN values are present.
+    Loads data from a pipe delimited CSV file, ensuring no NaN values are present.
+
+    The file is read with the pyarrow CSV reader using the types in CSV_COLUMN_TYPES for the standard manual columns 
+    ('heading' is boolean, references and text are strings). Blank boolean cells are False. The null check uses the 
+    null count Arrow keeps for each column rather than scanning the DataFrame.
 
     Parameters:
     -----------
@@ -74,14 +392,48 @@ def load_csv_data(path_to_file):
         logger.error(msg)
         raise FileNotFoundError(msg)
 
-    df = pd.read_csv(path_to_file, sep="|", encoding="utf-8", na_filter=False)  
+    read_options, parse_options, convert_options = _csv_read_options(path_to_file)
+    table = pv.read_csv(path_to_file, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+    # pandas reads an extra column with empty values as strings so read it again as a string column
+    inferred_with_nulls = [name for name, column in zip(table.column_names, table.columns) if column.null_count > 0 and name not in CSV_COLUMN_TYPES]
+    if inferred_with_nulls:
+        read_options, parse_options, convert_options = _csv_read_options(path_to_file, string_columns=inferred_with_nulls)
+        table = pv.read_csv(path_to_file, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+    table = _fill_blank_booleans(table)
+    _check_csv_nulls(table, path_to_file)
+    return table.to_pandas()
 
-    # Check for NaN values in the DataFrame
-    if df.isna().any().any():
-        msg = f'Encountered NaN values while loading {path_to_file}. This will cause ugly issues with the get_regulation_detail method'
+def iter_csv_data(path_to_file, block_size=CSV_BLOCK_SIZE):
+    """
+    Reads a CSV file like load_csv_data(...) but yields it as DataFrames of about block_size bytes each so a very 
+    large manual can be processed without holding all of it in memory. The types of the columns that are not in 
+    CSV_COLUMN_TYPES can't be inferred from the whole file so they are strings.
+
+    Parameters:
+    -----------
+    path_to_file : str
+        The path to the CSV file to be loaded.
+    block_size : int
+        The number of bytes of the file that are parsed into each DataFrame.
+
+    Raises:
+    -------
+    FileNotFoundError:
+        If the specified file does not exist.
+    ValueError:
+        If a chunk contains NaN values.
+    """
+    if not os.path.exists(path_to_file):
+        msg = f"Could not find the file {path_to_file}"
         logger.error(msg)
-        raise ValueError(msg)
-    return df
+        raise FileNotFoundError(msg)
+
+    read_options, parse_options, convert_options = _csv_read_options(path_to_file, block_size=block_size, string_columns=_csv_column_names(path_to_file))
+    with pv.open_csv(path_to_file, read_options=read_options, parse_options=parse_options, convert_options=convert_options) as reader:
+        for batch in reader:
+            table = _fill_blank_booleans(pa.Table.from_batches([batch]))
+            _check_csv_nulls(table, path_to_file)
+            yield table.to_pandas()
 
 def append_csv_data(path_to_file, original_df):
     if path_to_file == "":
@@ -96,10 +448,14 @@ def append_csv_data(path_to_file, original_df):
 
 def load_regulation_data_from_files(path_to_manual_as_csv_file, path_to_additional_manual_as_csv_file):
     df_regulations = load_csv_data(path_to_manual_as_csv_file)
-    df_regulations = append_csv_data(path_to_additional_manual_as_csv_file, df_regulations)
-    if df_regulations.isna().any().any():
+    if path_to_additional_manual_as_csv_file == "":
+        return df_regulations
+
+    # Both files are checked for nulls when they are loaded so the only way to get NaN values in the combined 
+    # DataFrame is if they don't have the same columns
+    df_additional = load_csv_data(path_to_additional_manual_as_csv_file).drop(columns=["sections_referenced"], errors="ignore")
+    if set(df_additional.columns) != set(df_regulations.columns):
         msg = f'Encountered NaN values while adding the two DataFrames together. This is caused because they dont have the same column names'
         logger.error(msg)
         raise ValueError(msg)
-    return df_regulations
-
+    return pd.concat([df_regulations, df_additional], ignore_index = True)
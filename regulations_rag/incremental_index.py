@@ -0,0 +1,249 @@
+import hashlib
+import logging
+import os
+import numpy as np
+import pandas as pd
+from regulations_rag.file_tools import load_csv_data, load_parquet_data, save_parquet_data
+from regulations_rag.regulation_table_of_content import split_tree
+
+logger = logging.getLogger(__name__)
+DEV_LEVEL = 15
+logging.addLevelName(DEV_LEVEL, 'DEV')
+
+section_hash_columns = ["document", "section_reference", "text_hash"]
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode()).hexdigest() if isinstance(text, str) else None
+
+
+def parse_sections_referenced(value):
+    """
+    Splits a 'sections_referenced' value like 'B.4(B)(i), B.4(B)(ii)' into a list of references.
+    """
+    if not isinstance(value, str):
+        return []
+    return [reference.strip() for reference in value.split(",") if reference.strip()]
+
+
+def load_sections_referenced(path_to_plus_csv, document_key):
+    """
+    Reads the 'sections_referenced' column of a "_plus.csv" manual file.
+
+    Parameters:
+    - path_to_plus_csv (str): The "_plus.csv" file.
+    - document_key (str): The key of the document in the corpus that the file belongs to.
+
+    Returns:
+    dict: From (document_key, section_reference) of each supplementary row to the list of sections of the manual it
+          depends on.
+    """
+    df = load_csv_data(path_to_plus_csv)
+    sections_referenced = {}
+    if "sections_referenced" not in df.columns:
+        return sections_referenced
+    for section_reference, value in zip(df["section_reference"], df["sections_referenced"]):
+        for reference in parse_sections_referenced(value):
+            references = sections_referenced.setdefault((document_key, section_reference), [])
+            if reference not in references:
+                references.append(reference)
+    return sections_referenced
+
+
+def _with_descendants(sections_referenced, corpus):
+    """
+    Adds the sections referenced by each section to all its ancestors in the document's table of content, because the
+    text of a section includes the text of its descendants.
+    """
+    inherited = {}
+    for (document, section_reference), references in sections_referenced.items():
+        inherited.setdefault((document, section_reference), set()).update(references)
+        doc = corpus.get_document(document) if corpus is not None else None
+        try:
+            node = doc.get_cached_toc().get_node(section_reference) if doc is not None else None
+        except ValueError:
+            logger.warning(f"{section_reference} is not in the table of content of {document} so its sections_referenced only apply to itself")
+            node = None
+        while node is not None and node.parent is not None and node.parent.full_node_name:
+            node = node.parent
+            inherited.setdefault((document, node.full_node_name), set()).update(references)
+    return inherited
+
+
+def get_row_dependencies(df, sections_referenced=None, corpus=None):
+    """
+    Returns, for each row of an index or definitions DataFrame, the set of (document, section_reference) whose text
+    the row depends on: its own section, the sections in its 'sections_referenced' column (if there is one) and the
+    sections that its section, or any of its descendants, references in the manual (sections_referenced, see 
+    load_sections_referenced(...)). The descendants are only found if corpus is provided.
+    """
+    sections_referenced = _with_descendants(sections_referenced or {}, corpus)
+    row_references = df["sections_referenced"] if "sections_referenced" in df.columns else [None] * len(df)
+    dependencies = []
+    for document, section_reference, references in zip(df["document"], df["section_reference"], row_references):
+        row_dependencies = set()
+        if isinstance(section_reference, str) and section_reference:
+            row_dependencies.add((document, section_reference))
+            row_dependencies.update((document, reference) for reference in sections_referenced.get((document, section_reference), []))
+        row_dependencies.update((document, reference) for reference in parse_sections_referenced(references))
+        dependencies.append(row_dependencies)
+    return dependencies
+
+
+def compute_section_hashes(corpus, sections):
+    """
+    Hashes the rendered text (Corpus.get_text(...)) of each (document, section_reference) in sections. The hash is
+    None if the section can't be rendered.
+
+    Returns:
+    pd.DataFrame: A DataFrame with the columns in section_hash_columns.
+    """
+    rows = []
+    for document, section_reference in sorted(sections):
+        try:
+            text = corpus.get_text(document, section_reference)
+        except Exception as e:
+            logger.warning(f"Unable to render {document} {section_reference} to hash it: {e}")
+            text = None
+        rows.append([document, section_reference, hash_text(text)])
+    return pd.DataFrame(rows, columns=section_hash_columns)
+
+
+def save_section_hashes(section_hashes, path_to_file):
+    section_hashes.to_parquet(path_to_file, engine='pyarrow', index=False)
+
+
+def load_section_hashes(path_to_file):
+    """
+    Returns the section hashes saved with save_section_hashes(...) or an empty DataFrame if the file does not exist
+    (so every row is rebuilt).
+    """
+    if not os.path.exists(path_to_file):
+        return pd.DataFrame([], columns=section_hash_columns)
+    return pd.read_parquet(path_to_file, engine='pyarrow')
+
+
+def _rechunk_section(df, position, corpus, token_limit, text_column):
+    """
+    Returns the rows that replace the chunk in row position of df: the chunks that split_tree(...) makes of its
+    section now. The other columns are copied from the chunk. A new chunk keeps the embedding of the old one if its
+    section and text did not change. There are no rows if the section is no longer in the document.
+    """
+    row = df.iloc[position]
+    document = corpus.get_document(row["document"])
+    toc = document.get_cached_toc()
+    try:
+        node = toc.get_node(row["section_reference"])
+    except ValueError:
+        logger.warning(f"{row['document']} {row['section_reference']} is no longer in the table of content so its chunk was removed")
+        return df.iloc[[]]
+    chunks = split_tree(node, document, toc, token_limit)
+    new_rows = df.iloc[[position] * len(chunks)].reset_index(drop=True)
+    new_rows["section_reference"] = chunks["section_reference"].to_list()
+    new_rows[text_column] = chunks["text"].to_list()
+    if "token_count" in new_rows.columns:
+        new_rows["token_count"] = chunks["token_count"].to_list()
+    unchanged = (new_rows["section_reference"] == row["section_reference"]) & (new_rows[text_column] == row[text_column])
+    new_rows["embedding"] = [row["embedding"] if keep else None for keep in unchanged]
+    return new_rows
+
+
+def incremental_rebuild(df, corpus, previous_section_hashes, get_embedding, sections_referenced=None, rebuild_text=None, text_column="text", token_limit=None):
+    """
+    Updates the embeddings of an index or definitions DataFrame, or of the chunks of a corpus (see 
+    regulations_rag.corpus.split_corpus(...)), after the documents in the corpus have changed, only doing work for the
+    rows that depend on a section whose rendered text has changed.
+
+    A row is stale if the hash of any of the sections it depends on (see get_row_dependencies(...)) is different from
+    (or missing in) previous_section_hashes. The stale rows are rebuilt in one of two ways:
+    - If token_limit is provided (this takes precedence over rebuild_text), df holds chunks and each stale chunk is replaced by the chunks that split_tree(...)
+      makes of its section with this token_limit. A section that has grown past the limit is split into its children
+      (a section that has shrunk is not merged with its siblings).
+    - If rebuild_text is provided, it is called for each stale row to re-create the row's text from the corpus.
+    A row is embedded if its text changed or it does not have an embedding yet. All other rows keep their embedding, 
+    so with neither token_limit nor rebuild_text the stale rows are only reported (and logged).
+
+    Parameters:
+    - df (pd.DataFrame): The index, definitions or chunks with the columns 'document', 'section_reference', 
+      text_column and (optionally) 'embedding'. It is not changed.
+    - corpus (Corpus): The current version of the documents.
+    - previous_section_hashes (pd.DataFrame): The section hashes returned by the previous build (see
+      load_section_hashes(...)).
+    - get_embedding (callable): Returns the embedding of a string.
+    - sections_referenced (dict, optional): See load_sections_referenced(...).
+    - rebuild_text (callable, optional): rebuild_text(row, corpus) returns the new text for a stale row.
+    - token_limit (int, optional): Re-chunk the stale rows with split_tree(...).
+
+    Returns:
+    - tuple: (the updated DataFrame, the current section hashes to save for the next build, a boolean Series of the
+      stale rows of df)
+    """
+    df = df.copy()
+    dependencies = get_row_dependencies(df, sections_referenced, corpus)
+    section_hashes = compute_section_hashes(corpus, set().union(*dependencies) if dependencies else set())
+
+    previous = {(document, section_reference): text_hash for document, section_reference, text_hash in
+                zip(previous_section_hashes["document"], previous_section_hashes["section_reference"], previous_section_hashes["text_hash"])}
+    current = {(document, section_reference): text_hash for document, section_reference, text_hash in
+               zip(section_hashes["document"], section_hashes["section_reference"], section_hashes["text_hash"])}
+    changed_sections = {section for section, text_hash in current.items() if text_hash is None or previous.get(section) != text_hash}
+    stale = pd.Series([bool(row_dependencies & changed_sections) for row_dependencies in dependencies], index=df.index)
+
+    if "embedding" not in df.columns:
+        df["embedding"] = None
+    df["embedding"] = df["embedding"].astype(object)
+    if token_limit is None and rebuild_text is None and stale.any():
+        skipped = [f"{document} {section_reference}" for document, section_reference in zip(df.loc[stale, "document"], df.loc[stale, "section_reference"])]
+        logger.warning(f"{stale.sum()} rows depend on sections that changed but were not rebuilt because there is no token_limit or rebuild_text: {', '.join(skipped)}")
+    if token_limit is not None:
+        pieces = []
+        start = 0
+        for position in np.flatnonzero(stale.to_numpy()):
+            pieces.append(df.iloc[start:position])
+            pieces.append(_rechunk_section(df, position, corpus, token_limit, text_column))
+            start = position + 1
+        pieces.append(df.iloc[start:])
+        df = pd.concat(pieces, ignore_index=True)
+        # hash the sections of any new chunks for the next build
+        new_sections = set().union(*get_row_dependencies(df, sections_referenced, corpus)) - set(current)
+        if new_sections:
+            section_hashes = pd.concat([section_hashes, compute_section_hashes(corpus, new_sections)], ignore_index=True)
+    elif rebuild_text is not None:
+        for index in df.index[stale]:
+            new_text = rebuild_text(df.loc[index], corpus)
+            if new_text != df.at[index, text_column]:
+                df.at[index, text_column] = new_text
+                df.at[index, "embedding"] = None
+
+    to_embed = df["embedding"].isna()
+    for index in df.index[to_embed]:
+        df.at[index, "embedding"] = get_embedding(df.at[index, text_column])
+
+    logger.log(DEV_LEVEL, f"{len(changed_sections)} sections changed, {stale.sum()} of {len(stale)} rows are stale and {to_embed.sum()} rows were embedded")
+    return df, section_hashes, stale
+
+
+def rebuild_index_file(path_to_index, corpus, path_to_section_hashes, get_embedding, decryption_key="", embedding_dtype=None, **kwargs):
+    """
+    Loads the index (or definitions or chunks) saved in path_to_index, brings it up to date with 
+    incremental_rebuild(...) using the section hashes saved by the previous build, and saves the result and the new
+    section hashes over the old files.
+
+    Parameters:
+    - path_to_index (str): The parquet file. See load_parquet_data(...) and save_parquet_data(...).
+    - corpus (Corpus): The current version of the documents.
+    - path_to_section_hashes (str): The section hashes of the previous build. Every row is stale if it does not exist.
+    - get_embedding (callable): Returns the embedding of a string.
+    - decryption_key (str, optional): The key used to encrypt the 'text' column.
+    - embedding_dtype (optional): See save_parquet_data(...).
+    - kwargs: sections_referenced, rebuild_text, text_column and token_limit are passed to incremental_rebuild(...).
+
+    Returns:
+    - tuple: (the updated DataFrame, a boolean Series of the stale rows of the previous index)
+    """
+    df = load_parquet_data(path_to_index, decryption_key)
+    df, section_hashes, stale = incremental_rebuild(df, corpus, load_section_hashes(path_to_section_hashes), get_embedding, **kwargs)
+    save_parquet_data(df, path_to_index, decryption_key, embedding_dtype=embedding_dtype)
+    save_section_hashes(section_hashes, path_to_section_hashes)
+    logger.log(DEV_LEVEL, f"Saved the rebuilt index {path_to_index}")
+    return df, stale
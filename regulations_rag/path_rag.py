@@ -380,9 +380,22 @@ class PathRAG:
                     document_name = df_definitions.iloc[extract_number-1]["document"]
                 else:
                     document_name = df_sections.iloc[extract_number-len(df_definitions)-1]["document"]
-                doc = self.corpus.get_document(document_name)
                 section_reference = match.group(2)
 
+                # Prefer a reference that is in the table of content of the document (or the primary document) to one
+                # that only has the right format
+                known_references = self.corpus.find_references(section_reference)
+                for candidate_document in [document_name, self.corpus.get_primary_document()]:
+                    for found_document, found_reference in known_references:
+                        if candidate_document and found_document == candidate_document:
+                            return {
+                                "RAGPath": self.RAGPath.SECTION.value, 
+                                "extract": extract_number, 
+                                "document": found_document, 
+                                "section": found_reference
+                            }
+
+                doc = self.corpus.get_document(document_name)
                 document_index = doc.reference_checker.text_version
                 if doc.reference_checker.is_valid(section_reference):
                     section_reference = doc.reference_checker.extract_valid_reference(section_reference)
@@ -638,7 +651,7 @@ class PathRAG:
         
         text_to_add = ""
         try: # passes index verification but there is an error retrieving the section
-            text_to_add = doc.get_text(modified_section_to_add)
+            text_to_add = self.corpus.get_text(result["document"], modified_section_to_add)
         except Exception as e:
             logger.log(DEV_LEVEL, f"add_section_to_resource tried to add {modified_section_to_add} but a call to get this regulation resulted in an exception {e}")
             return False, df_search_sections
@@ -1,4 +1,16 @@
+import functools
 import re
+import pandas as pd
+
+# Assertions that look at the text to the left of the current position. When a level is matched on its own the string
+# has been sliced so the level starts at position 0. That is no longer true inside the combined pattern so any level
+# after the first that uses one of these can't be combined.
+_LEFT_CONTEXT_PATTERN = re.compile(r'\\[bBA]|\(\?<[=!]|(?<![\[\\])\^')
+# Named groups and back references can't be repeated across the alternatives of the combined pattern
+_GROUP_REFERENCE_PATTERN = re.compile(r'\(\?P|\\\d')
+
+# The default number of references held in each of the per-instance caches of ReferenceChecker
+REFERENCE_CACHE_SIZE = 4096
 
 class ReferenceChecker:
     """
@@ -18,9 +30,19 @@ class ReferenceChecker:
         regex_list_of_indices (list): A list of regex patterns specifying the valid formats for indices.
         text_version (str, optional): A text description of the index format. Defaults to an empty string.
         exclusion_list (list, optional): A list of index formats that should be excluded from validation. Defaults to an empty list.
+
+        cache_size (int, optional): The maximum number of references held in each of the caches. Defaults to REFERENCE_CACHE_SIZE.
+
+    The patterns are compiled once here. is_valid() and split_reference() use a single anchored pattern that combines 
+    all the levels (see _compile_combined_pattern()) and fall back to matching one level at a time if the index 
+    patterns can't be combined.
+
+    split_reference(), get_parent_reference() and get_current_and_parent_references() only depend on their input so 
+    their results are held in bounded, per-instance LRU caches. is_reference_or_parents_in_list() uses the cached 
+    chain of parents. See cache_info().
     """
     
-    def __init__(self, regex_list_of_indices, text_version="", exclusion_list=[]):
+    def __init__(self, regex_list_of_indices, text_version="", exclusion_list=[], cache_size=REFERENCE_CACHE_SIZE):
         self.index_patterns = regex_list_of_indices
         self.exclusion_list = exclusion_list
         if text_version:
@@ -29,6 +51,101 @@ class ReferenceChecker:
             combined_pattern = "".join(f"({pattern.lstrip('^')})" for pattern in regex_list_of_indices)
             self.text_version = "r'" + combined_pattern + "'"
 
+        self._compiled_patterns = [re.compile(pattern) for pattern in regex_list_of_indices]
+        # the caret "^" is removed for re.search in extract_valid_reference()
+        self._compiled_search_patterns = [re.compile(pattern[1:] if pattern.startswith("^") else pattern) for pattern in regex_list_of_indices]
+        self._combined_pattern, self._combined_group_names = self._compile_combined_pattern(regex_list_of_indices)
+        self.cache_size = cache_size
+        self._create_caches()
+
+    def _create_caches(self):
+        self._split_reference_cache = functools.lru_cache(maxsize=self.cache_size)(self._split_reference)
+        self._parent_reference_cache = functools.lru_cache(maxsize=self.cache_size)(self._get_parent_reference)
+        self._current_and_parent_references_cache = functools.lru_cache(maxsize=self.cache_size)(self._get_current_and_parent_references)
+
+    def __getstate__(self):
+        # The caches wrap bound methods so they can't be pickled (for example when a Document is sent to a worker process)
+        state = self.__dict__.copy()
+        for cache_name in ["_split_reference_cache", "_parent_reference_cache", "_current_and_parent_references_cache"]:
+            state.pop(cache_name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "cache_size" in state:
+            self._create_caches()
+
+    def cache_info(self):
+        """
+        Returns the hits, misses, maxsize and currsize of each cache, keyed by the name of the cached method.
+        """
+        return {
+            "split_reference": self._split_reference_cache.cache_info(),
+            "get_parent_reference": self._parent_reference_cache.cache_info(),
+            "get_current_and_parent_references": self._current_and_parent_references_cache.cache_info(),
+        }
+
+    def cache_clear(self):
+        self._split_reference_cache.cache_clear()
+        self._parent_reference_cache.cache_clear()
+        self._current_and_parent_references_cache.cache_clear()
+
+    @staticmethod
+    def _compile_combined_pattern(index_patterns, group_prefix="level"):
+        """
+        Combines the index patterns into one anchored pattern that validates and splits a reference in a single match.
+
+        Matching one level at a time, a reference may start at any level. Leading levels that don't match are skipped 
+        but once a level has matched, every following level must match until the reference is used up. Each level 
+        takes the first match of its pattern and never gives any of it back. The combined pattern has one alternative 
+        per starting level:
+            (?!p0)...(?!pk-1) (?>pk) (?:(?!\\Z)(?>pk+1) (?:...)?)? \\Z
+        The negative lookaheads skip the leading levels only if they don't match and the atomic groups (?>...) stop 
+        the regex engine from backtracking into a level.
+
+        Returns:
+            tuple: The compiled pattern and, for each alternative, the names of the groups that hold the levels. 
+                   (None, None) if the patterns can't be combined.
+        """
+        patterns = [pattern[1:] if pattern.startswith("^") else pattern for pattern in index_patterns]
+        if not patterns:
+            return None, None
+        for level, pattern in enumerate(patterns):
+            if _GROUP_REFERENCE_PATTERN.search(pattern):
+                return None, None
+            if level > 0 and _LEFT_CONTEXT_PATTERN.search(pattern):
+                return None, None
+
+        alternatives = []
+        group_names = []
+        for start in range(len(patterns)):
+            names = [f"{group_prefix}_{start}_{level}" for level in range(start, len(patterns))]
+            chain = ""
+            for level in range(len(patterns) - 1, start - 1, -1):
+                chain = f"(?!\\Z)(?P<{names[level - start]}>(?>{patterns[level]})){chain}"
+                if level > start:
+                    chain = f"(?:{chain})?"
+            skipped = "".join(f"(?!{patterns[level]})" for level in range(start))
+            alternatives.append(skipped + chain)
+            group_names.append(names)
+        try:
+            combined_pattern = re.compile("\\A(?:" + "|".join(alternatives) + ")\\Z")
+        except re.error: # for example, atomic groups need python 3.11
+            return None, None
+        return combined_pattern, group_names
+
+    def _match_reference(self, reference):
+        """
+        Returns the levels of a reference matched using the combined pattern or None if the reference is not valid.
+        """
+        match = self._combined_pattern.match(reference)
+        if match is None:
+            return None
+        for names in self._combined_group_names:
+            if match.group(names[0]) is not None:
+                return [match.group(name) for name in names if match.group(name) is not None]
+        return None
+
     def is_valid(self, reference):
         """
         Validates if a reference is valid based on predefined patterns and exclusions.
@@ -39,14 +156,18 @@ class ReferenceChecker:
         Returns:
             bool: True if the reference is valid or in the exclusion list, False otherwise.
         """
+        if not isinstance(reference, str): # for example None or NaN from an empty cell in a DataFrame
+            return False
         if reference in self.exclusion_list:
             return True
+        if self._combined_pattern is not None:
+            return self._combined_pattern.match(reference) is not None
 
         reference_copy = reference
         pattern_matched = False
-        for pattern in self.index_patterns:
+        for pattern in self._compiled_patterns:
             if reference_copy:
-                match = re.match(pattern, reference_copy)
+                match = pattern.match(reference_copy)
                 if match:
                     reference_copy = reference_copy[match.end():]
                     pattern_matched = True
@@ -87,11 +208,9 @@ class ReferenceChecker:
         partial_ref = ""
         remaining_str = input_string
 
-        for pattern in self.index_patterns:
-            # the caret "^" is used in the index pattern because we only want the index at the start of the section but this causes potential issues here so it is removed 
-            if pattern[0] == "^":
-                pattern = pattern[1:]
-            match = re.search(pattern, remaining_str)
+        # the caret "^" is used in the index pattern because we only want the index at the start of the section but this causes potential issues here so it is removed 
+        for pattern in self._compiled_search_patterns:
+            match = pattern.search(remaining_str)
             if match:
                 partial_ref += match.group()
                 remaining_str = remaining_str[match.end():]
@@ -119,20 +238,28 @@ class ReferenceChecker:
             ValueError: If the reference does not fully match the provided patterns or if there's unmatched
                         text remaining.
         """
-        components = []
-        if reference == "":
-            return components
+        # the cache holds tuples so the caller can't change the cached value
+        return list(self._split_reference_cache(reference))
+
+    def _split_reference(self, reference):
+        if not isinstance(reference, str) or reference == "":
+            return ()
         if reference in self.exclusion_list:
-            components.append(reference)
-            return components
+            return (reference,)
+        if self._combined_pattern is not None:
+            components = self._match_reference(reference)
+            if components is None:
+                raise ValueError(f'The input index {reference} did not comply with the schema')
+            return tuple(components)
 
         # Initialize variables
+        components = []
         reference_copy = reference
         pattern_matched = False
 
-        for pattern in self.index_patterns:
+        for pattern in self._compiled_patterns:
             if reference_copy:
-                match = re.match(pattern, reference_copy)
+                match = pattern.match(reference_copy)
                 if match:
                     components.append(match.group(0))
                     reference_copy = reference_copy[match.end():]
@@ -145,6 +272,74 @@ class ReferenceChecker:
         if reference_copy:
             raise ValueError(f'The input index {reference} did not comply with the schema')
 
+        return tuple(components)
+
+    def _can_use_combined_pattern(self, method_name):
+        # Subclasses that override the single reference method (for example to strip a prefix) need it to be called
+        return getattr(self, "_combined_pattern", None) is not None and getattr(type(self), method_name) is getattr(ReferenceChecker, method_name)
+
+    def validate_many(self, references):
+        """
+        The bulk version of is_valid(). Validates an entire column of references with one pass of the combined pattern.
+
+        Parameters:
+            references (pd.Series or list): The references to validate. Values that are not strings are not valid.
+
+        Returns:
+            pd.Series: A boolean mask with the same index as references.
+        """
+        references = pd.Series(references, dtype=object) if not isinstance(references, pd.Series) else references.astype(object)
+        if not self._can_use_combined_pattern("is_valid"):
+            def is_valid_or_false(reference):
+                try:
+                    return bool(self.is_valid(reference))
+                except Exception:
+                    return False
+            return references.map(is_valid_or_false).astype(bool)
+
+        is_string = references.map(type) == str
+        # Values that are not strings are replaced with "" which never matches the combined pattern
+        strings = references.where(is_string, "")
+        return is_string & (strings.isin(self.exclusion_list) | strings.str.match(self._combined_pattern.pattern))
+
+    def split_many(self, references):
+        """
+        The bulk version of split_reference(). Splits an entire column of references with one pass of the combined 
+        pattern.
+
+        Parameters:
+            references (pd.Series or list): The references to split.
+
+        Returns:
+            pd.DataFrame: A DataFrame with the same index as references and one column per level, 'component_0', 
+                          'component_1', ... Each row holds the output of split_reference() followed by NaN. Rows 
+                          that are not valid (and empty references) are all NaN.
+        """
+        references = pd.Series(references, dtype=object) if not isinstance(references, pd.Series) else references.astype(object)
+        if not self._can_use_combined_pattern("split_reference"):
+            split_references = []
+            for reference in references:
+                try:
+                    split_references.append(list(self.split_reference(reference) or []))
+                except Exception:
+                    split_references.append([])
+            number_of_columns = max([len(getattr(self, "index_patterns", []))] + [len(split) for split in split_references] + [1])
+            columns = [f"component_{i}" for i in range(number_of_columns)]
+            return pd.DataFrame([split + [float("nan")] * (number_of_columns - len(split)) for split in split_references], 
+                                index=references.index, columns=columns, dtype=object)
+
+        columns = [f"component_{i}" for i in range(max(len(self.index_patterns), 1))]
+        components = pd.DataFrame(float("nan"), index=references.index, columns=columns, dtype=object)
+        is_string = references.map(type) == str
+        strings = references.where(is_string, "")
+        extracted = strings.str.extract(self._combined_pattern.pattern)
+        for names in self._combined_group_names:
+            for position, name in enumerate(names):
+                components[columns[position]] = components[columns[position]].combine_first(extracted[name])
+        is_excluded = is_string & (strings != "") & strings.isin(self.exclusion_list)
+        if is_excluded.any():
+            components.loc[is_excluded, :] = float("nan")
+            components.loc[is_excluded, columns[0]] = strings[is_excluded]
         return components
 
     def get_parent_reference(self, input_string):
@@ -164,6 +359,9 @@ class ReferenceChecker:
         Raises:
             ValueError: If the input_string is empty or if valid components cannot be extracted from it.
         """
+        return self._parent_reference_cache(input_string)
+
+    def _get_parent_reference(self, input_string):
         if input_string == "":
             return ""
             # raise ValueError(f"Unable to get parent string for empty input")
@@ -190,12 +388,15 @@ class ReferenceChecker:
         Returns:
             list: A list containing the given reference and all its parent references.
         """
+        return list(self._current_and_parent_references_cache(reference))
+
+    def _get_current_and_parent_references(self, reference):
         parents = [reference]
         while reference:
             reference = self.get_parent_reference(reference)
             if reference:
                 parents.append(reference)
-        return parents
+        return tuple(parents)
 
     def is_reference_or_parents_in_list(self, reference, list_of_references):
         """
@@ -240,8 +441,8 @@ class ReferenceChecker:
             tuple: A tuple containing the extracted index (or an empty string if no index is found) and the
                 remaining string after removing the index and any immediate following space.
         """
-        for pattern in self.index_patterns:
-            match = re.match(pattern, s)
+        for pattern in self._compiled_patterns:
+            match = pattern.match(s)
             if match:
                 # If a match is found, return the matched index and the remaining string
                 return match.group(0), s[match.end()+1:] # there is always a space after the index
@@ -290,28 +491,71 @@ class EmptyReferenceChecker(ReferenceChecker):
 
 
 class MultiReferenceChecker(ReferenceChecker):
+    """
+    Combines reference checkers for documents that use more than one referencing scheme. A reference belongs to the 
+    first checker in the list that considers it valid.
+
+    Rather than asking each checker in turn, the checkers' combined patterns (and exclusion lists) are joined into one 
+    alternation with a named group per checker so a single match routes the reference to its checker. If any of the 
+    checkers can't be combined (for example because it overrides is_valid()) they are asked in turn.
+    """
     def __init__(self, list_of_reference_checkers):
         self.list_of_reference_checkers = list_of_reference_checkers
+        self._dispatch_pattern = self._compile_dispatch_pattern(list_of_reference_checkers)
+
+    @staticmethod
+    def _compile_dispatch_pattern(list_of_reference_checkers):
+        alternatives = []
+        for i, ref_checker in enumerate(list_of_reference_checkers):
+            if not isinstance(ref_checker, ReferenceChecker) or not ref_checker._can_use_combined_pattern("is_valid"):
+                return None
+            # the group names have to be unique across all the checkers
+            checker_pattern, _ = ReferenceChecker._compile_combined_pattern(ref_checker.index_patterns, group_prefix=f"checker_{i}_level")
+            if checker_pattern is None:
+                return None
+            checker_alternatives = [checker_pattern.pattern] + [re.escape(item) + "\\Z" for item in ref_checker.exclusion_list]
+            alternatives.append(f"(?P<checker_{i}>" + "|".join(checker_alternatives) + ")")
+        if not alternatives:
+            return None
+        try:
+            return re.compile("\\A(?:" + "|".join(alternatives) + ")")
+        except re.error:
+            return None
+
+    def _find_reference_checker(self, reference):
+        """
+        Returns the first reference checker that considers the reference valid or None.
+        """
+        if self._dispatch_pattern is not None and isinstance(reference, str):
+            match = self._dispatch_pattern.match(reference)
+            if match is None:
+                return None
+            for i, ref_checker in enumerate(self.list_of_reference_checkers):
+                if match.group(f"checker_{i}") is not None:
+                    return ref_checker
+            return None
 
-    def is_valid(self, reference):
         for ref_checker in self.list_of_reference_checkers:
             if ref_checker.is_valid(reference):
-                return True
-        return False
+                return ref_checker
+        return None
+
+    def is_valid(self, reference):
+        return self._find_reference_checker(reference) is not None
 
     def extract_valid_reference(self, reference):
         raise NotImplementedError()
 
     def split_reference(self, reference):
-        for ref_checker in self.list_of_reference_checkers:
-            if ref_checker.is_valid(reference):
-                return ref_checker.split_reference(reference)
+        ref_checker = self._find_reference_checker(reference)
+        if ref_checker is not None:
+            return ref_checker.split_reference(reference)
         return ""
 
     def get_parent_reference(self, reference):
-        for ref_checker in self.list_of_reference_checkers:
-            if ref_checker.is_valid(reference):
-                return ref_checker.get_parent_reference(reference)
+        ref_checker = self._find_reference_checker(reference)
+        if ref_checker is not None:
+            return ref_checker.get_parent_reference(reference)
         return ""
     
     def get_current_and_parent_references(self, reference):
@@ -322,5 +566,3 @@ class MultiReferenceChecker(ReferenceChecker):
 
     def _extract_reference_from_string(self, s):
         raise NotImplementedError()
-
-
@@ -1,17 +1,45 @@
 import logging
-from anytree import Node, RenderTree, find, LevelOrderIter, AsciiStyle
+from concurrent.futures import ProcessPoolExecutor
+from anytree import Node, RenderTree, find, LevelOrderIter, PreOrderIter, AsciiStyle
 import re
 import pandas as pd
 from regulations_rag.embeddings import num_tokens_from_string
 
 logger = logging.getLogger(__name__)
 
+FOOTNOTE_LINE_PATTERN = re.compile(r'\[\^\d+\]\:')
+FOOTNOTE_MARKER_PATTERN = re.compile(r'\[\^\d+\]')
+
 class TableOfContentEntry(Node):
+    # TableOfContent.nodes_by_reference, only set on the root of a table of content
+    _nodes_by_reference = None
+
     def __init__(self, name, full_node_name, parent=None, heading_text=''):
+        # children indexed by name. This is kept up to date by the anytree attach / detach hooks below
+        self.children_by_name = {}
         super().__init__(name, parent=parent)
         self.heading_text = heading_text
         self.full_node_name = full_node_name
 
+    def _post_attach(self, parent):
+        if isinstance(parent, TableOfContentEntry):
+            parent.children_by_name.setdefault(self.name, self)
+
+    def _post_detach(self, parent):
+        if not isinstance(parent, TableOfContentEntry):
+            return
+        if parent.children_by_name.get(self.name) is self:
+            del parent.children_by_name[self.name]
+        # the detached subtree is no longer in the table of content so get_node(...) must not find it
+        nodes_by_reference = parent.root._nodes_by_reference
+        if nodes_by_reference is not None:
+            for node in PreOrderIter(self):
+                if nodes_by_reference.get(node.full_node_name) is node:
+                    del nodes_by_reference[node.full_node_name]
+
+    def get_child(self, name):
+        return self.children_by_name.get(name)
+
     def consolidate_from_leaves(self, consolidate_headings):
         if not self.children:
             return self.heading_text
@@ -24,42 +52,64 @@ class TableOfContent:
     def __init__(self, root_id, reference_checker):
         self.root = TableOfContentEntry(root_id, "", parent=None, heading_text='')
         self.reference_checker = reference_checker
+        # every node added with add_to_toc(...), keyed by its full reference, so lookups do not need to walk the tree
+        self.nodes_by_reference = {}
+        self.root._nodes_by_reference = self.nodes_by_reference
 
     def add_to_toc(self, section_reference, heading_text=''):
         if section_reference == self.root.name:
             self.root.heading_text = heading_text
             return
 
+        existing_node = self.nodes_by_reference.get(section_reference)
+        if existing_node is not None:
+            if not existing_node.heading_text:
+                existing_node.heading_text = heading_text
+            return
+
         if not self.reference_checker.is_valid(section_reference):
             raise ValueError(f'{section_reference} is not a valid section_reference')
 
         node_names = self.reference_checker.split_reference(section_reference)
+        self._insert_node(section_reference, node_names, heading_text)
+
+    def _insert_node(self, section_reference, node_names, heading_text=''):
+        """
+        Adds a node, and any missing parents, for a reference that has already been validated and split into node_names.
+        """
         current_parent = self.root
         full_node_name = ''
 
         for i, node_name in enumerate(node_names):
             full_node_name += node_name
-            found_node = next((child for child in current_parent.children if child.name == node_name), None)
+            found_node = current_parent.get_child(node_name)
 
             if found_node is None:
                 heading = heading_text if i == len(node_names) - 1 else ''
                 current_parent = TableOfContentEntry(node_name, full_node_name, parent=current_parent, heading_text=heading)
+                self.nodes_by_reference.setdefault(full_node_name, current_parent)
             else:
                 current_parent = found_node
 
             if i == len(node_names) - 1 and not current_parent.heading_text:
                 current_parent.heading_text = heading_text
 
+        if node_names:
+            self.nodes_by_reference.setdefault(section_reference, current_parent)
+
     def get_node(self, section_reference):
         if section_reference == self.root.name:
             return self.root
+        node = self.nodes_by_reference.get(section_reference)
+        if node is not None:
+            return node
         if not self.reference_checker.is_valid(section_reference):
             raise ValueError(f'{section_reference} is not a valid section_reference')
         
         current_node = self.root
         node_names = self.reference_checker.split_reference(section_reference)
         for node_name in node_names:
-            current_node = next((node for node in current_node.children if node.name == node_name), None)
+            current_node = current_node.get_child(node_name)
             if current_node is None:
                 raise ValueError(f"Node with path {section_reference} does not exist in the tree")
         return current_node
@@ -107,28 +157,86 @@ class StandardTableOfContent(TableOfContent):
             logger.error(message)
             raise AttributeError(message)
 
-        for i, row in regulation_df.iterrows():
-            try:
-                heading_text = row['text'] if row['heading'] else ''
-                heading_text = self.remove_footnotes(heading_text).strip()
+        self._build(regulation_df)
 
-                if not reference_checker.is_valid(row['section_reference']):
-                    raise ValueError(f"{row['section_reference']} is not a valid reference. See row {i}")
+    @classmethod
+    def from_nodes(cls, root_node_name, reference_checker, regulation_df, nodes_df):
+        """
+        Recreates a table of content from a flat list of nodes (see regulations_rag.toc_snapshot) without validating or
+        splitting any references.
 
-                super().add_to_toc(row['section_reference'], heading_text=heading_text)
+        Parameters:
+        - nodes_df (pd.DataFrame): One row per node with the columns 'full_node_name', 'name', 'parent_full_node_name'
+          and 'heading_text'. Parents must come before their children.
+        """
+        toc = cls.__new__(cls)
+        TableOfContent.__init__(toc, root_node_name, reference_checker=reference_checker)
+        toc.regulation_df = regulation_df
+        nodes = {"": toc.root}
+        for full_node_name, name, parent_full_node_name, heading_text in zip(nodes_df["full_node_name"].to_list(), 
+                                                                              nodes_df["name"].to_list(),
+                                                                              nodes_df["parent_full_node_name"].to_list(),
+                                                                              nodes_df["heading_text"].to_list()):
+            node = TableOfContentEntry(name, full_node_name, parent=nodes[parent_full_node_name], heading_text=heading_text)
+            nodes[full_node_name] = node
+            toc.nodes_by_reference.setdefault(full_node_name, node)
+        return toc
+
+    def _build(self, regulation_df):
+        """
+        Builds the tree in bulk. Each distinct reference is validated and split once, nodes are inserted in the order
+        in which their references first appear and the heading of a node is the first non-empty heading for its 
+        reference. This gives the same tree as adding the rows one at a time with add_to_toc(...).
 
-            except Exception as e:
-                logger.error(f"An error occurred at row {i}:")
-                logger.error(regulation_df.iloc[i])
-                logger.error(f"Error message: {e}")
-                break
+        All the invalid rows are reported together in a single ValueError.
+        """
+        references = regulation_df['section_reference'].to_list()
+        heading_texts = [self.remove_footnotes(text).strip() if heading else '' 
+                         for heading, text in zip(regulation_df['heading'].to_list(), regulation_df['text'].to_list())]
+
+        unique_references = list(dict.fromkeys(references))
+        split_references = self._validate_and_split(unique_references)
+
+        invalid_rows = [i for i, reference in enumerate(references) if split_references[reference] is None]
+        if invalid_rows:
+            invalid_descriptions = [f"row {regulation_df.index[i]}: '{references[i]}'" for i in invalid_rows]
+            message = f"{len(invalid_rows)} rows do not have a valid section_reference: {', '.join(invalid_descriptions)}"
+            logger.error(message)
+            raise ValueError(message)
+
+        headings = {}
+        for reference, heading_text in zip(references, heading_texts):
+            if reference == self.root.name:
+                headings[reference] = heading_text # add_to_toc(...) overwrites the root heading
+            elif heading_text and not headings.get(reference):
+                headings[reference] = heading_text
+
+        for reference in unique_references:
+            if reference == self.root.name:
+                self.root.heading_text = headings.get(reference, '')
+            else:
+                self._insert_node(reference, split_references[reference], headings.get(reference, ''))
+
+    def _validate_and_split(self, references):
+        """
+        Returns a dictionary from each reference to its components or None if the reference is not valid. All the 
+        references are validated and split in bulk by the reference checker.
+        """
+        references = pd.Series(references, dtype=object)
+        is_valid = self.reference_checker.validate_many(references)
+        components = self.reference_checker.split_many(references[is_valid])
+        split_references = {reference: None for reference in references}
+        for reference, row in zip(references[is_valid], components.to_numpy(dtype=object)):
+            split_references[reference] = [component for component in row if isinstance(component, str)]
+        return split_references
 
     def remove_footnotes(self, text):
-        footnote_pattern = r'\[\^\d+\]\:'
+        if "[^" not in text:
+            return text
         lines = text.split('\n')
-        remaining_text = [line for line in lines if not re.match(footnote_pattern, line)]
+        remaining_text = [line for line in lines if not FOOTNOTE_LINE_PATTERN.match(line)]
         text = '\n'.join(remaining_text)
-        return re.sub(r'\[\^\d+\]', '', text)
+        return FOOTNOTE_MARKER_PATTERN.sub('', text)
 
     def check_columns(self):
         """
@@ -148,7 +256,7 @@ class StandardTableOfContent(TableOfContent):
             return False
         return True
 
-def _split_recursive(node, document, table_of_content, token_limit, node_list=[]):
+def _split_recursive(node, document, table_of_content, token_limit, node_list=[], rendered_sections=None):
 #def _split_recursive(node, regulation_reader, table_of_content, token_limit, node_list=[]):
     """    
     Recursively splits nodes based on token limits and collects valid nodes in a list.
@@ -160,6 +268,8 @@ def _split_recursive(node, document, table_of_content, token_limit, node_list=[]
     - token_limit (int): The maximum allowed token count per section.
     - reference_checker (callable): Function to check if an index is valid.
     - node_list (list, optional): List to collect nodes meeting the token criteria.
+    - rendered_sections (dict, optional): If provided, the text and token count of each node in node_list are stored
+      here, keyed by the node, so they do not have to be rendered again.
     
     Returns:
     - list: A list of nodes that meet the token criteria.
@@ -175,10 +285,12 @@ def _split_recursive(node, document, table_of_content, token_limit, node_list=[]
         if not node.children:
             raise Exception(f'Node {node.full_node_name} has no children but has a token count of {token_count} so it cannot be split into nodes that contain fewer tokens that {token_limit}')
         for child in node.children:
-            _split_recursive(child, document, table_of_content, token_limit, node_list)
+            _split_recursive(child, document, table_of_content, token_limit, node_list, rendered_sections)
             #_split_recursive(child, regulation_reader, table_of_content, token_limit, node_list)
     else:
         node_list.append(node)
+        if rendered_sections is not None:
+            rendered_sections[node] = (subsection_text, token_count)
 
     return node_list
 
@@ -201,10 +313,11 @@ def split_tree(node, document, table_of_content, token_limit):
     - pd.DataFrame: A DataFrame with columns ['section_reference', 'text', 'token_count'] for each valid section_reference.
     """
     #node_list = _split_recursive(node, regulation_reader, table_of_content, token_limit, node_list=[])
-    node_list = _split_recursive(node, document, table_of_content, token_limit, node_list=[])
+    rendered_sections = {}
+    node_list = _split_recursive(node, document, table_of_content, token_limit, node_list=[], rendered_sections=rendered_sections)
     section_token_count = [[node.full_node_name, 
-                            document.get_text(node.full_node_name),
-                            num_tokens_from_string(document.get_text(node.full_node_name))] 
+                            rendered_sections[node][0],
+                            rendered_sections[node][1]] 
                            for node in node_list]
     # section_token_count = [[node.full_node_name, 
     #                         regulation_reader.get_regulation_detail(node.full_node_name),
@@ -215,3 +328,150 @@ def split_tree(node, document, table_of_content, token_limit):
     return pd.DataFrame(section_token_count, columns=['section_reference', 'text', 'token_count'])
 
 
+def _subtree_token_totals(node, document, totals):
+    """
+    Post-order traversal that stores, for every node below (and including) node, the number of tokens in its own 
+    rows plus the tokens of all its descendants' rows. Each node's own text is rendered exactly once and the total of
+    each child is reused by its parent.
+    """
+    if node.full_node_name:
+        own_text = document.get_text(node.full_node_name, add_markdown_decorators=True, add_headings=False, section_only=True)
+        own_tokens = num_tokens_from_string(own_text)
+    else:
+        own_tokens = 0 # the root does not have rows of its own
+    totals[node] = own_tokens + sum(_subtree_token_totals(child, document, totals) for child in node.children)
+    return totals[node]
+
+
+def split_tree_single_pass(node, document, token_limit, estimate_margin=0.1):
+    """
+    Splits a tree starting from a given node into sections that don't exceed a token limit, like split_tree(), but 
+    without rendering every node on the way down.
+
+    The token total of every node is calculated bottom-up in one traversal from the tokens in each node's own rows and 
+    the tokens in the headings of its parents. A node whose estimate is more than estimate_margin (a fraction of the
+    token_limit) over the limit is split into its children without being rendered. Every other node is rendered once
+    and split on its actual token count, exactly as split_tree() does. Tokens are close to, but not perfectly, additive 
+    so the margin keeps the output the same as split_tree().
+
+    Parameters:
+    - node (Node): The starting node to split the tree.
+    - document (Document): The document the tree was built from.
+    - token_limit (int): The maximum allowed token count per section.
+    - estimate_margin (float, optional): How far over the limit an estimate has to be before the node is split
+      without being rendered.
+
+    Returns:
+    - pd.DataFrame: A DataFrame with columns ['section_reference', 'text', 'token_count'] for each selected node.
+    """
+    totals = {}
+    _subtree_token_totals(node, document, totals)
+
+    heading_tokens = {}
+    def get_heading_tokens(chunk_node):
+        parent = chunk_node.parent
+        if parent is None or not parent.full_node_name:
+            return 0
+        if parent not in heading_tokens:
+            heading_tokens[parent] = num_tokens_from_string(document.get_heading(parent.full_node_name, add_markdown_decorators=True))
+        return heading_tokens[parent]
+
+    section_token_count = []
+    nodes_to_process = [node]
+    while nodes_to_process:
+        current = nodes_to_process.pop()
+        estimated_token_count = get_heading_tokens(current) + totals[current]
+        if current.children and estimated_token_count > token_limit * (1 + estimate_margin):
+            nodes_to_process.extend(reversed(current.children))
+            continue
+
+        text = document.get_text(current.full_node_name)
+        token_count = num_tokens_from_string(text)
+        if token_count > token_limit:
+            if not current.children:
+                raise Exception(f'Node {current.full_node_name} has no children but has a token count of {token_count} so it cannot be split into nodes that contain fewer tokens that {token_limit}')
+            nodes_to_process.extend(reversed(current.children))
+            continue
+        section_token_count.append([current.full_node_name, text, token_count])
+
+    return pd.DataFrame(section_token_count, columns=['section_reference', 'text', 'token_count'])
+
+
+# Documents used by the worker processes in split_documents_parallel(). They are sent once to each worker (using the
+# pool initializer) rather than once per task.
+_worker_documents = {}
+
+def _init_split_worker(documents):
+    global _worker_documents
+    _worker_documents = documents
+
+def _split_node_worker(document_key, section_reference, token_limit):
+    """
+    Splits the tree below one node of one document. If section_reference is None, the root node is only checked and 
+    the single chunk for the whole document is returned if it is within the token limit (otherwise None). Like 
+    split_tree(), this raises if the root is over the limit and has no children.
+    """
+    document = _worker_documents[document_key]
+    toc = document.get_cached_toc()
+    if section_reference is None:
+        text = document.get_text(toc.root.full_node_name)
+        token_count = num_tokens_from_string(text)
+        if token_count > token_limit:
+            if not toc.root.children:
+                raise Exception(f'Node {toc.root.full_node_name} has no children but has a token count of {token_count} so it cannot be split into nodes that contain fewer tokens that {token_limit}')
+            return None
+        return pd.DataFrame([[toc.root.full_node_name, text, token_count]], columns=['section_reference', 'text', 'token_count'])
+    return split_tree(toc.get_node(section_reference), document, toc, token_limit)
+
+
+def split_documents_parallel(documents, token_limit, max_workers=None):
+    """
+    Runs split_tree() from the root of each document using a process pool. The root of every document is checked 
+    first and only the documents that are over the token limit are fanned out over their top-level nodes. The results
+    are merged in document order and then in tree order, so the output is the same as calling split_tree() on each 
+    document in turn.
+
+    Parameters:
+    - documents (dict): Document instances keyed by the value to use in the 'document' column.
+    - token_limit (int): The maximum allowed token count per section.
+    - max_workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+    - pd.DataFrame: A DataFrame with columns ['document', 'section_reference', 'text', 'token_count'].
+    """
+    document_chunks = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_split_worker, initargs=(documents,)) as executor:
+        root_futures = {document_key: executor.submit(_split_node_worker, document_key, None, token_limit) for document_key in documents}
+        top_level_futures = {}
+        for document_key, future in root_futures.items():
+            whole_document = future.result()
+            if whole_document is not None:
+                document_chunks[document_key] = [whole_document]
+            else:
+                toc = documents[document_key].get_cached_toc()
+                top_level_futures[document_key] = [executor.submit(_split_node_worker, document_key, child.full_node_name, token_limit) for child in toc.root.children]
+        for document_key, futures in top_level_futures.items():
+            document_chunks[document_key] = [future.result() for future in futures]
+
+    chunks = []
+    for document_key in documents:
+        for chunk in document_chunks[document_key]:
+            chunk = chunk.copy()
+            chunk.insert(0, 'document', document_key)
+            chunks.append(chunk)
+
+    if not chunks:
+        return pd.DataFrame([], columns=['document', 'section_reference', 'text', 'token_count'])
+    return pd.concat(chunks, ignore_index=True)
+
+
+def split_tree_parallel(document, token_limit, max_workers=None):
+    """
+    Splits a whole document into sections that don't exceed a token limit, processing the top-level nodes of its 
+    table of content in parallel. See split_documents_parallel().
+
+    Returns:
+    - pd.DataFrame: A DataFrame with columns ['section_reference', 'text', 'token_count'].
+    """
+    chunks = split_documents_parallel({document.name: document}, token_limit, max_workers)
+    return chunks.drop(columns=['document'])
@@ -0,0 +1,109 @@
+import logging
+import sys
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+DEV_LEVEL = 15
+logging.addLevelName(DEV_LEVEL, 'DEV')
+
+
+class RenderCache:
+    """
+    A bounded, least recently used cache for rendered section text.
+
+    The text returned by Document.get_text(...) only depends on the (static) document and the arguments of the call so
+    it can be reused between calls and between users. The same section is typically rendered several times when
+    answering a single question (token capping, building the user prompt, formatting the references) so the cache
+    sits in front of Corpus.get_text(...).
+
+    The cache is bounded by the approximate number of bytes held in the cached strings rather than by the number of
+    entries because sections vary from a single line to entire chapters.
+
+    Attributes:
+        max_bytes (int): The budget for the cached strings. A value of 0 disables the cache.
+        current_bytes (int): The approximate number of bytes currently held in the cache.
+        hits (int): The number of lookups that were served from the cache.
+        misses (int): The number of lookups that were not in the cache.
+        evictions (int): The number of entries removed to stay within max_bytes.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(document_key, section_reference, add_markdown_decorators=True, add_headings=True, section_only=False):
+        return (document_key, section_reference, add_markdown_decorators, add_headings, section_only)
+
+    def get(self, key):
+        """
+        Returns the cached text for the key or None if the key is not in the cache.
+        """
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        """
+        Adds text to the cache, evicting the least recently used entries if the byte budget is exceeded. Text that
+        is larger than the entire budget is not cached.
+        """
+        if text is None:
+            return
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= sys.getsizeof(self._entries.pop(key))
+            self._entries[key] = text
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= sys.getsizeof(evicted)
+                self.evictions += 1
+
+    def invalidate_document(self, document_key):
+        """
+        Removes all the cached text for a document. This must be called when a document is reloaded.
+        """
+        with self._lock:
+            stale_keys = [key for key in self._entries if key[0] == document_key]
+            for key in stale_keys:
+                self.current_bytes -= sys.getsizeof(self._entries.pop(key))
+        if stale_keys:
+            logger.log(DEV_LEVEL, f"Removed {len(stale_keys)} rendered sections for {document_key} from the render cache")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the hit / miss statistics and the current size of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,141 @@
+import logging
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from anytree import PreOrderIter
+from regulations_rag.embeddings import num_tokens_from_string
+from regulations_rag.toc_snapshot import document_source_hash
+
+logger = logging.getLogger(__name__)
+DEV_LEVEL = 15
+logging.addLevelName(DEV_LEVEL, 'DEV')
+
+# The (add_markdown_decorators, add_headings, section_only) combinations that are used on the request path:
+# Corpus.get_text(...) with its defaults (token capping and formatting references) and
+# DataFrameCorpusIndex.get_relevant_sections(...) which asks for text without markdown
+DEFAULT_RENDER_FLAGS = [
+    (True, True, False),
+    (False, True, False),
+]
+
+section_store_columns = ["section_reference", "add_markdown_decorators", "add_headings", "section_only", "text", "token_count"]
+
+
+def build_section_store(document, render_flags=DEFAULT_RENDER_FLAGS):
+    """
+    Renders every node in the document's table of content for each combination of flags in render_flags.
+
+    This is a build step. The output of Document.get_text(...) is a pure function of the static document so it can
+    be rendered once, saved with save_section_store(...) and served from a SectionStore on the request path.
+
+    Parameters:
+    - document (Document): The document to render.
+    - render_flags (list): A list of (add_markdown_decorators, add_headings, section_only) tuples.
+
+    Returns:
+    - pd.DataFrame: A DataFrame with the columns in section_store_columns. One row per node and flag combination. The
+      regulations_rag.toc_snapshot.document_source_hash(...) of the document is in its attrs["source_hash"].
+    """
+    rows = []
+    toc = document.get_toc()
+    for node in PreOrderIter(toc.root):
+        for add_markdown_decorators, add_headings, section_only in render_flags:
+            text = document.get_text(node.full_node_name, add_markdown_decorators, add_headings, section_only)
+            rows.append([node.full_node_name, add_markdown_decorators, add_headings, section_only, text, num_tokens_from_string(text)])
+
+    logger.log(DEV_LEVEL, f"Rendered {len(rows)} sections for the document {document.name}")
+    section_store_df = pd.DataFrame(rows, columns=section_store_columns)
+    section_store_df.attrs["source_hash"] = document_source_hash(document)
+    return section_store_df
+
+
+def save_section_store(section_store_df, path_to_file):
+    """
+    Saves the output of build_section_store(...) as a parquet file. Section references repeat once per flag combination
+    so they are stored as a categorical (dictionary encoded) column. The source hash of the document is saved in the
+    file's metadata so Document.load_section_store(...) can tell if the document has changed since.
+    """
+    df = section_store_df.copy()
+    df["section_reference"] = df["section_reference"].astype("category")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    source_hash = section_store_df.attrs.get("source_hash")
+    if source_hash is not None:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"source_hash": source_hash.encode()})
+    pq.write_table(table, path_to_file)
+
+
+class SectionStore:
+    """
+    Serves pre-rendered section text and token counts produced by build_section_store(...).
+
+    Lookups are keyed by (section_reference, add_markdown_decorators, add_headings, section_only). A lookup for a
+    combination that was not rendered at build time returns None so the caller can fall back to rendering the text.
+
+    The text is kept in an Arrow array and each section is only converted to a Python string when it is asked for, so
+    a store read from a memory mapped file (see from_table(...)) does not copy the text out of the map.
+    """
+    def __init__(self, section_store_df):
+        missing_columns = [col for col in section_store_columns if col not in section_store_df.columns]
+        if missing_columns:
+            msg = f"The section store is missing the columns: {', '.join(missing_columns)}"
+            logger.error(msg)
+            raise AttributeError(msg)
+
+        self._set_sections(section_store_df["section_reference"].astype(str).to_list(),
+                           section_store_df["add_markdown_decorators"].astype(bool).to_list(),
+                           section_store_df["add_headings"].astype(bool).to_list(),
+                           section_store_df["section_only"].astype(bool).to_list(),
+                           pa.array(section_store_df["text"].to_list(), type=pa.string()),
+                           section_store_df["token_count"].astype(int).to_list())
+        self.source_hash = section_store_df.attrs.get("source_hash")
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Creates the store from an Arrow table with the columns in section_store_columns without converting the text.
+        The source hash is read from the table's schema metadata if save_section_store(...) wrote one.
+        """
+        missing_columns = [col for col in section_store_columns if col not in table.column_names]
+        if missing_columns:
+            msg = f"The section store is missing the columns: {', '.join(missing_columns)}"
+            logger.error(msg)
+            raise AttributeError(msg)
+
+        texts = table.column("text")
+        texts = texts.chunk(0) if texts.num_chunks == 1 else texts.combine_chunks()
+        store = cls.__new__(cls)
+        store._set_sections([str(reference) for reference in table.column("section_reference").to_pylist()],
+                            table.column("add_markdown_decorators").to_pylist(),
+                            table.column("add_headings").to_pylist(),
+                            table.column("section_only").to_pylist(),
+                            texts,
+                            table.column("token_count").to_pylist())
+        metadata = table.schema.metadata or {}
+        store.source_hash = metadata[b"source_hash"].decode() if b"source_hash" in metadata else None
+        return store
+
+    def _set_sections(self, section_references, add_markdown_decorators, add_headings, section_only, texts, token_counts):
+        keys = zip(section_references, add_markdown_decorators, add_headings, section_only)
+        self._positions = {key: position for position, key in enumerate(keys)}
+        self._texts = texts
+        self._token_counts = token_counts
+
+    @classmethod
+    def from_file(cls, path_to_file):
+        if not os.path.exists(path_to_file):
+            msg = f"Could not find the file {path_to_file}"
+            logger.error(msg)
+            raise FileNotFoundError(msg)
+        return cls.from_table(pq.read_table(path_to_file))
+
+    def get_text(self, section_reference, add_markdown_decorators=True, add_headings=True, section_only=False):
+        position = self._positions.get((section_reference, add_markdown_decorators, add_headings, section_only))
+        return self._texts[position].as_py() if position is not None else None
+
+    def get_token_count(self, section_reference, add_markdown_decorators=True, add_headings=True, section_only=False):
+        position = self._positions.get((section_reference, add_markdown_decorators, add_headings, section_only))
+        return self._token_counts[position] if position is not None else None
+
+    def __len__(self):
+        return len(self._positions)
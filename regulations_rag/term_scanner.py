@@ -0,0 +1,226 @@
+import logging
+import re
+from collections import deque, namedtuple
+from anytree import PreOrderIter
+
+logger = logging.getLogger(__name__)
+DEV_LEVEL = 15
+logging.addLevelName(DEV_LEVEL, 'DEV')
+
+# A definition is usually written as "<term> means ..." or "<term>: ..."
+DEFINED_TERM_PATTERN = re.compile(r'^\s*(.{2,80}?)(?:\s+means\b|\s*:)', re.IGNORECASE)
+
+ScanMatch = namedtuple("ScanMatch", ["start", "end", "kind", "document", "value", "row"])
+
+
+def _fold(text):
+    """
+    Lower case text without changing the position of any character so the offsets of matches in the folded text are
+    the same as in the original text.
+    """
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return "".join(char.lower() if len(char.lower()) == 1 else char for char in text)
+
+
+class AhoCorasick:
+    """
+    A pure python Aho-Corasick automaton. All the occurrences of all the patterns in a piece of text are found in one
+    pass over the text, irrespective of the number of patterns.
+
+    Patterns are added with a payload. The automaton is built on the first call to iter_matches(...) after a pattern
+    has been added.
+    """
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._built = True
+
+    def add(self, pattern, payload):
+        if not pattern:
+            return
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((len(pattern), payload))
+        self._built = False
+
+    def build(self):
+        """
+        Sets the failure links breadth first and merges the output of each node with the output of its failure node.
+        """
+        queue = deque()
+        for node in self._goto[0].values():
+            self._fail[node] = 0
+            queue.append(node)
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(char, 0)
+                self._output[next_node] = self._output[next_node] + self._output[self._fail[next_node]]
+        self._built = True
+
+    def iter_matches(self, text):
+        """
+        Yields (start, end, payload) for every occurrence of every pattern in text, including overlapping occurrences.
+        """
+        if not self._built:
+            self.build()
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, payload in output[node]:
+                yield position - length + 1, position + 1, payload
+
+    def __len__(self):
+        return len(self._goto)
+
+
+def extract_defined_term(definition):
+    """
+    Returns the term defined in a definition of the form "<term> means ..." or "<term>: ..." or None.
+    """
+    if not isinstance(definition, str):
+        return None
+    match = DEFINED_TERM_PATTERN.match(definition)
+    return match.group(1).strip() if match else None
+
+
+class CorpusScanner:
+    """
+    Finds the section references of the documents in a corpus and the terms defined in a definitions DataFrame in
+    free text, for example to check the references cited by the LLM or to attach the definitions to the sections
+    retrieved for a question without searching the embeddings.
+
+    Every reference in every document's table of content and every defined term goes into one (case insensitive)
+    Aho-Corasick automaton. References must match with their original case. A match is only accepted if it does not
+    start or end in the middle of a word or number, so 'A.1' is not found in 'A.12' or 'A.1.2'.
+
+    Parameters:
+        corpus (Corpus, optional): The references in the table of content of each of its documents are added (see
+                                   Corpus.get_section_references(...)).
+        definitions (pd.DataFrame, optional): A 'term' column if there is one, otherwise the term extracted from the
+                                              'definition' column with extract_defined_term(...). The 'document' column
+                                              is used if it is present.
+    """
+    REFERENCE = "reference"
+    DEFINITION = "definition"
+
+    def __init__(self, corpus=None, definitions=None):
+        self._automaton = AhoCorasick()
+        self.definitions = definitions
+        if corpus is not None:
+            for document_key in corpus.all_documents:
+                self.add_references(document_key, corpus.get_section_references(document_key))
+        if definitions is not None:
+            self.add_definitions(definitions)
+
+    def add_document(self, document_key, document):
+        toc = document.get_cached_toc()
+        self.add_references(document_key, [node.full_node_name for node in PreOrderIter(toc.root) if node is not toc.root and node.full_node_name])
+
+    def add_references(self, document_key, references):
+        for reference in references:
+            self._automaton.add(_fold(reference), (self.REFERENCE, document_key, reference, None))
+        logger.log(DEV_LEVEL, f"Added {len(references)} references from {document_key} to the scanner")
+
+    def add_definitions(self, definitions):
+        if "term" in definitions.columns:
+            terms = definitions["term"]
+        else:
+            terms = definitions["definition"].map(extract_defined_term)
+        documents = definitions["document"] if "document" in definitions.columns else [""] * len(definitions)
+        for row, term, document_key in zip(definitions.index, terms, documents):
+            if isinstance(term, str) and term.strip():
+                self._automaton.add(_fold(term.strip()), (self.DEFINITION, document_key, term.strip(), row))
+
+    @staticmethod
+    def _is_whole_word(text, start, end):
+        if start > 0 and text[start - 1].isalnum() and text[start].isalnum():
+            return False
+        if end < len(text) and text[end].isalnum() and text[end - 1].isalnum():
+            return False
+        return True
+
+    @staticmethod
+    def _is_whole_reference(text, start, end):
+        # 'A.' is not a reference in 'A.21' and '1' is not a reference in '1.35' but '1.3' is at the end of a sentence.
+        # In the same way '1.2' is not a reference in '1.1.2'
+        if start > 0 and text[start - 1].isalnum():
+            return False
+        if start > 1 and text[start - 1] == "." and text[start - 2].isalnum():
+            return False
+        if end < len(text) and text[end].isalnum():
+            return False
+        if end + 1 < len(text) and text[end] == "." and text[end + 1].isalnum():
+            return False
+        return True
+
+    def scan(self, text, longest_only=True):
+        """
+        Returns the references and defined terms found in text as a list of ScanMatch(start, end, kind, document,
+        value, row) ordered by position. 'row' is the index of the definition (None for references).
+
+        If longest_only is True, overlapping matches of the same kind are resolved in favour of the leftmost and
+        then the longest match so 'A.1(B)' is returned rather than 'A.1' and 'A.1(B)'. Matches of exactly the same
+        text (for example the same reference in two documents) are all returned.
+        """
+        if not text:
+            return []
+        matches = []
+        for start, end, (kind, document_key, value, row) in self._automaton.iter_matches(_fold(text)):
+            if kind == self.REFERENCE:
+                if text[start:end] != value or not self._is_whole_reference(text, start, end):
+                    continue
+            elif not self._is_whole_word(text, start, end):
+                continue
+            matches.append(ScanMatch(start, end, kind, document_key, value, row))
+
+        matches.sort(key=lambda match: (match.start, -(match.end - match.start)))
+        if not longest_only:
+            return matches
+        selected = []
+        last_span = {self.REFERENCE: (-1, 0), self.DEFINITION: (-1, 0)}
+        for match in matches:
+            if match.start >= last_span[match.kind][1] or (match.start, match.end) == last_span[match.kind]:
+                selected.append(match)
+                last_span[match.kind] = (match.start, match.end)
+        return selected
+
+    def find_references(self, text):
+        """
+        Returns a list of unique (document, section_reference) tuples in the order they appear in text.
+        """
+        references = []
+        for match in self.scan(text):
+            if match.kind == self.REFERENCE and (match.document, match.value) not in references:
+                references.append((match.document, match.value))
+        return references
+
+    def find_definitions(self, text):
+        """
+        Returns the rows of the definitions DataFrame whose term appears in text, in the order they appear.
+        """
+        if self.definitions is None:
+            return None
+        rows = []
+        for match in self.scan(text):
+            if match.kind == self.DEFINITION and match.row not in rows:
+                rows.append(match.row)
+        return self.definitions.loc[rows]
@@ -0,0 +1,147 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from anytree import PreOrderIter
+from regulations_rag.regulation_table_of_content import StandardTableOfContent
+
+logger = logging.getLogger(__name__)
+DEV_LEVEL = 15
+logging.addLevelName(DEV_LEVEL, 'DEV')
+
+SNAPSHOT_VERSION = 3
+snapshot_columns = ["full_node_name", "name", "parent_full_node_name", "heading_text"]
+
+
+def content_hash(df, extra=""):
+    """
+    A hash of the content of a DataFrame (values, column names and index). Used to decide if a snapshot that was
+    derived from the DataFrame is still valid.
+
+    Parameters:
+        df (pd.DataFrame): The source of the document.
+        extra (str): Anything else that the derived data depends on, for example the name of the root node.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps([str(col) for col in df.columns]).encode())
+    hasher.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    hasher.update(extra.encode())
+    return hasher.hexdigest()
+
+
+def reference_checker_signature(reference_checker):
+    """
+    A description of everything a reference checker uses to validate and split references: its class, patterns and
+    exclusion list (and those of the checkers inside a MultiReferenceChecker).
+    """
+    signature = {"class": f"{type(reference_checker).__module__}.{type(reference_checker).__qualname__}"}
+    for attribute in ["index_patterns", "text_version", "exclusion_list"]:
+        if hasattr(reference_checker, attribute):
+            signature[attribute] = getattr(reference_checker, attribute)
+    if hasattr(reference_checker, "list_of_reference_checkers"):
+        signature["checkers"] = [reference_checker_signature(checker) for checker in reference_checker.list_of_reference_checkers]
+    return json.dumps(signature, sort_keys=True, default=str)
+
+
+@functools.lru_cache(maxsize=None)
+def _file_hash(path_to_file):
+    try:
+        with open(path_to_file, "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except OSError:
+        return ""
+
+
+def document_source_hash(document):
+    """
+    The hash that a table of content snapshot of a document is keyed on: the content of document_as_df, the name of 
+    the document, its reference checker (see reference_checker_signature(...)) and its class, including the source 
+    of the module that defines the class so a change to an overridden get_toc() is picked up.
+    """
+    document_class = type(document)
+    try:
+        class_source = _file_hash(inspect.getfile(document_class))
+    except TypeError:
+        class_source = ""
+    extra = json.dumps([document.name,
+                        f"{document_class.__module__}.{document_class.__qualname__}",
+                        class_source,
+                        reference_checker_signature(document.reference_checker)])
+    return content_hash(document.document_as_df, extra=extra)
+
+
+def toc_to_frame(toc):
+    """
+    Flattens a table of content into one row per node (in pre-order, so parents always come before their children).
+    """
+    rows = []
+    for node in PreOrderIter(toc.root):
+        if node is toc.root:
+            continue
+        rows.append([node.full_node_name, node.name, node.parent.full_node_name, node.heading_text])
+    return pd.DataFrame(rows, columns=snapshot_columns)
+
+
+def save_toc_snapshot(toc, path_to_file, source_hash):
+    """
+    Saves a table of content as a parquet file. The hash of the source document, the signature of the table of
+    content's own reference checker (see reference_checker_signature(...)) and the root node are stored in the file
+    metadata. Only a StandardTableOfContent can be saved because load_toc_snapshot(...) rebuilds one.
+    """
+    if type(toc) is not StandardTableOfContent:
+        raise ValueError(f"Only a StandardTableOfContent can be saved as a snapshot, not a {type(toc).__name__}")
+    table = pa.Table.from_pandas(toc_to_frame(toc), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"toc_snapshot"] = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "source_hash": source_hash,
+        "reference_checker": reference_checker_signature(toc.reference_checker),
+        "root_name": toc.root.name,
+        "root_heading_text": toc.root.heading_text,
+    }).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), path_to_file)
+    logger.log(DEV_LEVEL, f"Saved the table of content snapshot {path_to_file}")
+
+
+def read_toc_snapshot_metadata(path_to_file):
+    """
+    Returns the snapshot metadata (version, source_hash, reference_checker, root_name, root_heading_text) without reading the nodes or
+    None if the file does not exist or is not a snapshot.
+    """
+    if not os.path.exists(path_to_file):
+        return None
+    metadata = pq.read_schema(path_to_file).metadata or {}
+    if b"toc_snapshot" not in metadata:
+        return None
+    return json.loads(metadata[b"toc_snapshot"].decode())
+
+
+def load_toc_snapshot(path_to_file, reference_checker, source_hash, regulation_df=None):
+    """
+    Loads a table of content saved with save_toc_snapshot(...) and rebuilds it with reference_checker, which must be
+    the same kind of checker that the table of content was built with.
+
+    Returns:
+        StandardTableOfContent or None: None if there is no snapshot, it was written by a different version of the
+                                        format, it was built from a different version of the source document or with
+                                        a different reference checker.
+    """
+    snapshot_metadata = read_toc_snapshot_metadata(path_to_file)
+    if snapshot_metadata is None:
+        return None
+    if snapshot_metadata["version"] != SNAPSHOT_VERSION or snapshot_metadata["source_hash"] != source_hash:
+        logger.log(DEV_LEVEL, f"The table of content snapshot {path_to_file} is out of date")
+        return None
+    if snapshot_metadata["reference_checker"] != reference_checker_signature(reference_checker):
+        logger.log(DEV_LEVEL, f"The table of content snapshot {path_to_file} was built with a different reference checker")
+        return None
+
+    nodes_df = pd.read_parquet(path_to_file, engine='pyarrow')
+    toc = StandardTableOfContent.from_nodes(snapshot_metadata["root_name"], reference_checker, regulation_df, nodes_df)
+    toc.root.heading_text = snapshot_metadata["root_heading_text"]
+    return toc
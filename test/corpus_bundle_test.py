@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+from anytree import PreOrderIter
+from regulations_rag.corpus import Corpus, LazyDocument
+from regulations_rag.corpus_bundle import CorpusBundle, save_corpus_bundle
+from regulations_rag.corpus_index import DataFrameCorpusIndex
+from regulations_rag.file_tools import load_csv_data
+from regulations_rag.regulation_table_of_content import StandardTableOfContent
+from test.navigating_corpus import NavigatingCorpus
+from test.documents.wrr_document import WRR
+from test.documents.plett_document import Plett
+from test.reference_checker_samples import TESTReferenceChecker
+
+
+def _index_frames():
+    return [pd.read_parquet(f"./test/inputs/{name}.parquet", engine="pyarrow") for name in ["navigation_dfns", "navigation_index", "navigation_workflow"]]
+
+def test_save_and_load_bundle(tmp_path):
+    path_to_bundle = str(tmp_path / "navigating.bundle")
+    definitions, index, workflow = _index_frames()
+    save_corpus_bundle(path_to_bundle, NavigatingCorpus(), definitions, index, workflow)
+
+    bundle = CorpusBundle(path_to_bundle)
+    assert "documents/Plett/sections" in bundle.section_names()
+
+    rendered = NavigatingCorpus()
+    corpus = Corpus({"WRR": WRR(), "Plett": Plett()}, bundle=path_to_bundle)
+    for document_key in ["WRR", "Plett"]:
+        document = corpus.get_document(document_key)
+        assert document.section_store is not None
+        toc = document.get_cached_toc()
+        expected_toc = rendered.get_document(document_key).get_toc()
+        assert [(node.full_node_name, node.heading_text) for node in PreOrderIter(toc.root)] == \
+               [(node.full_node_name, node.heading_text) for node in PreOrderIter(expected_toc.root)]
+        for node in PreOrderIter(toc.root):
+            assert document.get_stored_text(node.full_node_name) == rendered.get_text(document_key, node.full_node_name)
+
+    corpus_index = DataFrameCorpusIndex.from_bundle("a Visitor", "Plett", corpus, bundle)
+    for loaded, original in zip([corpus_index.definitions, corpus_index.index, corpus_index.workflow], [definitions, index, workflow]):
+        assert loaded.drop(columns=["embedding"]).equals(original.drop(columns=["embedding"]))
+        assert np.array_equal(np.stack(loaded["embedding"].to_list()), np.stack(original["embedding"].to_list()))
+
+def test_out_of_date_bundle_is_not_used(tmp_path):
+    path_to_bundle = str(tmp_path / "navigating.bundle")
+    save_corpus_bundle(path_to_bundle, NavigatingCorpus())
+    plett = Plett()
+    df = plett.document_as_df.copy()
+    df.loc[0, "text"] = df.loc[0, "text"] + " changed"
+    plett.document_as_df = df
+    assert not CorpusBundle(path_to_bundle).apply_to_document("Plett", plett)
+    assert plett.section_store is None
+
+class CsvPlett(Plett):
+    def __init__(self, path_to_file):
+        super().__init__()
+        self.document_as_df = load_csv_data(path_to_file)
+
+def test_documents_are_built_by_their_constructor(tmp_path):
+    path_to_bundle = str(tmp_path / "plett.bundle")
+    path_to_csv = str(tmp_path / "plett.csv")
+    Plett().document_as_df.to_csv(path_to_csv, sep="|", index=False)
+    save_corpus_bundle(path_to_bundle, Corpus({"Plett": CsvPlett(path_to_csv)}))
+
+    rendered = NavigatingCorpus()
+    corpus = Corpus({"Plett": LazyDocument(lambda: CsvPlett(path_to_csv))}, bundle=path_to_bundle)
+    document = corpus.get_document("Plett")
+    assert type(document) is CsvPlett
+    assert document.section_store is not None
+    for node in PreOrderIter(document.get_cached_toc().root):
+        assert corpus.get_text("Plett", node.full_node_name) == rendered.get_text("Plett", node.full_node_name)
+
+    # once the CSV file changes, the bundle is not used for the document
+    df = load_csv_data(path_to_csv)
+    df.loc[df["section_reference"] == "A.2(B)(ii)", "text"] = "Turn left into Whale Rock Drive"
+    df.to_csv(path_to_csv, sep="|", index=False)
+    corpus = Corpus({"Plett": LazyDocument(lambda: CsvPlett(path_to_csv))}, bundle=path_to_bundle)
+    assert corpus.get_document("Plett").section_store is None
+    assert "Continue straight" not in corpus.get_text("Plett", "A.2(B)(ii)")
+
+def test_toc_with_its_own_reference_checker_is_not_bundled(tmp_path):
+    class AnnexReferenceChecker(TESTReferenceChecker):
+        def __init__(self):
+            super().__init__()
+            self.exclusion_list = self.exclusion_list + ["Annex"]
+    class AnnexPlett(Plett):
+        def get_toc(self):
+            return StandardTableOfContent(root_node_name=self.name, reference_checker=AnnexReferenceChecker(), regulation_df=self.document_as_df)
+
+    path_to_bundle = str(tmp_path / "annex.bundle")
+    save_corpus_bundle(path_to_bundle, Corpus({"Plett": AnnexPlett()}))
+    bundle = CorpusBundle(path_to_bundle)
+    assert not bundle.has_section("documents/Plett/toc")
+    corpus = Corpus({"Plett": AnnexPlett()}, bundle=bundle)
+    document = corpus.get_document("Plett")
+    assert document.section_store is not None
+    document.get_cached_toc().add_to_toc("Annex")
+
+def test_not_a_bundle(tmp_path):
+    path_to_file = tmp_path / "not_a.bundle"
+    path_to_file.write_bytes(b"PAR1" + b"\x00" * 32)
+    with pytest.raises(ValueError):
+        CorpusBundle(str(path_to_file))
@@ -73,3 +73,27 @@ def test_get_text_and_footnotes_with_footnotes(wrr_document):
     expected_footnotes = ['[^1]: Directions from 11 Turnstone']
     assert text == expected_text
     assert footnotes == expected_footnotes
+
+def test_ancestor_heading_cache(wrr_document):
+    wrr_document.get_text("1.2")
+    wrr_document.get_text("1.3", add_markdown_decorators=False)
+    assert wrr_document._get_ancestor_headings("1.2", True) == ("# 1 Navigating Whale Rock Ridge\n\n", ())
+    assert ("1.3", False) in wrr_document._ancestor_heading_cache
+
+    wrr_document.document_as_df = wrr_document.document_as_df.copy()
+    assert wrr_document._ancestor_heading_cache == {}
+
+def test_footnotes_are_split_at_load(wrr_document):
+    row = wrr_document._rows.rows[1]
+    assert row.text == "Whale Rock Ridge is a large complex. Here are directions to help you[^1]."
+    assert row.footnotes == ("[^1]: Directions from 11 Turnstone",)
+    assert wrr_document._rows.rows[0].footnotes == ()
+
+def test_compact_rows(wrr_document):
+    rows = wrr_document._rows
+    assert len(rows) == len(wrr_document.document_as_df)
+    assert rows.section_references == wrr_document.document_as_df["section_reference"].to_list()
+    assert [row["text"] for row in rows.get_rows("1.2")] == ["To Main Gate", "Turn left out driveway. Road turns left. At the first stop street, turn right. Proceed to Gate"]
+    assert "1.2" in rows
+    assert "1.4" not in rows
+    assert rows.get_rows("1.4") == []
@@ -0,0 +1,182 @@
+import pandas as pd
+from cryptography.fernet import Fernet
+from regulations_rag.file_tools import load_parquet_data, load_parquet_dataset, save_parquet_data, load_embedding_matrix, decrypt_text, LazyTextDecryptor, load_csv_data, iter_csv_data, load_regulation_data_from_files
+
+
+def _encrypted_frame(key, number_of_rows):
+    fernet = Fernet(key)
+    text = [f"Row {i} of the manual" for i in range(number_of_rows)]
+    return pd.DataFrame({"section_reference": [f"A.{i}" for i in range(number_of_rows)],
+                         "text": [fernet.encrypt(line.encode()).decode() for line in text]}), text
+
+def test_decrypt_text():
+    key = Fernet.generate_key().decode()
+    df, text = _encrypted_frame(key, 25)
+    assert decrypt_text(df["text"].to_list(), key) == text
+    # several chunks, decrypted in a pool, are put back together in order
+    assert decrypt_text(df["text"].to_list(), key, max_workers=2, chunk_size=4) == text
+    assert decrypt_text([], key) == []
+
+def test_decrypt_text_does_not_start_a_pool_by_default(monkeypatch):
+    import regulations_rag.file_tools as file_tools
+    def no_pool(*args, **kwargs):
+        raise AssertionError("A process pool should only be used if max_workers > 1")
+    monkeypatch.setattr(file_tools, "ProcessPoolExecutor", no_pool)
+    key = Fernet.generate_key().decode()
+    df, text = _encrypted_frame(key, 25)
+    assert decrypt_text(df["text"].to_list(), key, chunk_size=4) == text
+    assert decrypt_text(df["text"].to_list(), key, max_workers=1, chunk_size=4) == text
+
+def test_load_parquet_data(tmp_path):
+    key = Fernet.generate_key().decode()
+    df, text = _encrypted_frame(key, 10)
+    path_to_file = str(tmp_path / "encrypted.parquet")
+    df.to_parquet(path_to_file, engine="pyarrow")
+
+    loaded = load_parquet_data(path_to_file, key)
+    assert loaded["text"].to_list() == text
+    assert loaded["section_reference"].to_list() == df["section_reference"].to_list()
+    assert load_parquet_data(path_to_file)["text"].to_list() == df["text"].to_list()
+
+def test_lazy_text_decryptor():
+    key = Fernet.generate_key().decode()
+    df, text = _encrypted_frame(key, 5)
+    decryptor = LazyTextDecryptor(key, cache_size=2)
+    assert decryptor.decrypt(df["text"].iloc[0]) == text[0]
+    assert decryptor.decrypt_many(df["text"].iloc[:2].to_list()) == text[:2]
+    assert decryptor.cache_info().hits == 1
+    assert decryptor.cache_info().currsize == 2
+
+def test_load_parquet_data_pushdown(tmp_path):
+    key = Fernet.generate_key().decode()
+    df, text = _encrypted_frame(key, 6)
+    df["source"] = ["question", "heading"] * 3
+    path_to_file = str(tmp_path / "index.parquet")
+    df.to_parquet(path_to_file, engine="pyarrow")
+
+    loaded = load_parquet_data(path_to_file, key, columns=["section_reference", "text"], filters=[("source", "==", "question")])
+    assert loaded.columns.to_list() == ["section_reference", "text"]
+    assert loaded["text"].to_list() == text[0::2]
+    # decryption is skipped if the text column is not read
+    assert load_parquet_data(path_to_file, key, columns=["source"])["source"].to_list() == df["source"].to_list()
+
+def test_load_parquet_dataset(tmp_path):
+    key = Fernet.generate_key().decode()
+    df, text = _encrypted_frame(key, 4)
+    df["document"] = ["WRR", "Plett", "WRR", "Plett"]
+    plus_df, plus_text = _encrypted_frame(key, 2)
+    plus_df["document"] = "WRR"
+    plus_df["sections_referenced"] = "A.1"
+    paths = [str(tmp_path / "index.parquet"), str(tmp_path / "index_plus.parquet")]
+    df.to_parquet(paths[0], engine="pyarrow")
+    plus_df.to_parquet(paths[1], engine="pyarrow")
+
+    expected = pd.concat([df, plus_df], ignore_index=True)
+    expected["text"] = text + plus_text
+    loaded = load_parquet_dataset(paths + [""], key)
+    assert loaded.columns.to_list() == expected.columns.to_list()
+    assert loaded.drop(columns=["sections_referenced"]).equals(expected.drop(columns=["sections_referenced"]))
+    assert loaded["sections_referenced"].isna().sum() == 4
+
+    loaded = load_parquet_dataset(paths, key, columns=["document", "text"], filters=[("document", "in", {"WRR"})])
+    assert loaded["text"].to_list() == [text[0], text[2]] + plus_text
+
+def test_fixed_size_list_embeddings(tmp_path):
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = pd.DataFrame({"section_reference": ["A.1", "A.2", "A.3"],
+                       "embedding": [np.array([0.1, 0.2, 0.3, 0.4]) * i for i in range(1, 4)],
+                       "text": ["one", "two", "three"]})
+    path_to_file = str(tmp_path / "index.parquet")
+    open(path_to_file, "w").close()
+    # the embeddings keep their precision unless a smaller type is asked for
+    save_parquet_data(df, path_to_file)
+    assert pq.read_schema(path_to_file).field("embedding").type == pa.list_(pa.float64(), 4)
+    save_parquet_data(df, path_to_file, embedding_dtype=np.float32)
+    assert pq.read_schema(path_to_file).field("embedding").type == pa.list_(pa.float32(), 4)
+
+    loaded = load_parquet_data(path_to_file)
+    assert loaded.columns.to_list() == df.columns.to_list()
+    matrix = load_embedding_matrix(path_to_file)
+    assert matrix.shape == (3, 4) and matrix.dtype == np.float32
+    assert np.allclose(np.stack(loaded["embedding"].to_list()), np.stack(df["embedding"].to_list()))
+    # the rows are views of one contiguous array
+    assert loaded["embedding"].iloc[0].base is loaded["embedding"].iloc[2].base
+
+    # files written with variable length lists of floats are still read as a matrix, with their original type
+    old_path = str(tmp_path / "old_index.parquet")
+    df.to_parquet(old_path, engine="pyarrow")
+    loaded = load_parquet_data(old_path)
+    assert np.array_equal(np.stack(loaded["embedding"].to_list()), np.stack(df["embedding"].to_list()))
+    assert load_embedding_matrix(old_path).dtype == np.float64
+
+def test_load_parquet_dataset_mixed_embedding_types(tmp_path):
+    import numpy as np
+    import pyarrow.parquet as pq
+
+    df = pd.DataFrame({"section_reference": ["A.1", "A.2"], "embedding": [np.array([0.1, 0.2]), np.array([0.3, 0.4])]})
+    plus_df = pd.DataFrame({"section_reference": ["Z.1"], "embedding": [np.array([0.5, 0.6])]})
+    paths = [str(tmp_path / "index.parquet"), str(tmp_path / "index_plus.parquet")]
+    # an index file written before the embeddings were stored as a FixedSizeList and a new "_plus" file
+    df.to_parquet(paths[0], engine="pyarrow")
+    open(paths[1], "w").close()
+    save_parquet_data(plus_df, paths[1], embedding_dtype=np.float32)
+    assert pq.read_schema(paths[0]).field("embedding").type != pq.read_schema(paths[1]).field("embedding").type
+
+    loaded = load_parquet_dataset(paths)
+    assert loaded["section_reference"].to_list() == ["A.1", "A.2", "Z.1"]
+    matrix = np.stack(loaded["embedding"].to_list())
+    assert matrix.dtype == np.float64
+    assert np.allclose(matrix, np.stack(df["embedding"].to_list() + plus_df["embedding"].to_list()))
+
+def test_save_parquet_data_encrypted(tmp_path):
+    import pytest
+    key = Fernet.generate_key().decode()
+    text = [f"Row {i} of the manual" for i in range(9)]
+    df = pd.DataFrame({"section_reference": [f"A.{i}" for i in range(9)], "text": text})
+    path_to_file = str(tmp_path / "encrypted.parquet")
+    open(path_to_file, "w").close()
+
+    save_parquet_data(df, path_to_file, key, max_workers=2)
+    assert df["text"].to_list() == text
+    stored = pd.read_parquet(path_to_file, engine="pyarrow")
+    assert stored["text"].to_list() != text
+    assert load_parquet_data(path_to_file, key)["text"].to_list() == text
+
+    # a failed write leaves the frame as it was
+    with pytest.raises(Exception):
+        save_parquet_data(df, str(tmp_path), key)
+    assert df["text"].to_list() == text
+
+def test_load_csv_data(tmp_path):
+    expected = pd.read_csv("./test/inputs/manual.csv", sep="|", encoding="utf-8", na_filter=False)
+    df = load_csv_data("./test/inputs/manual.csv")
+    assert df.columns.to_list() == expected.columns.to_list()
+    assert df["heading"].dtype == bool
+    assert df["document"].dtype == object
+    assert (df.astype(str).values == expected.astype(str).values).all()
+
+    chunks = list(iter_csv_data("./test/inputs/manual.csv", block_size=4096))
+    assert len(chunks) > 1
+    assert pd.concat(chunks, ignore_index=True)["text"].to_list() == expected["text"].to_list()
+
+    combined = load_regulation_data_from_files("./test/inputs/manual.csv", "./test/inputs/manual_plus.csv")
+    assert "sections_referenced" not in combined.columns
+    assert len(combined) == len(df) + len(load_csv_data("./test/inputs/manual_plus.csv"))
+
+    # a byte order mark, 0/1 and blank headings are read like pandas did
+    with open(tmp_path / "bom.csv", "w", encoding="utf-8-sig") as file:
+        file.write("section_reference|heading|text\nA.1|1|Heading\nA.1|0|Text\nA.2||More text\n")
+    df = load_csv_data(str(tmp_path / "bom.csv"))
+    assert df.columns.to_list() == ["section_reference", "heading", "text"]
+    assert df["heading"].to_list() == [True, False, False]
+
+    with open(tmp_path / "missing.csv", "w") as file:
+        file.write("indent|reference|text|heading\n0|A.1||True\n|(a)|Text|False\n")
+    try:
+        load_csv_data(str(tmp_path / "missing.csv"))
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+from regulations_rag.file_tools import load_parquet_data
+from regulations_rag.incremental_index import incremental_rebuild, rebuild_index_file, get_row_dependencies, load_sections_referenced, parse_sections_referenced, save_section_hashes, load_section_hashes
+from regulations_rag.regulation_table_of_content import split_tree
+from test.navigating_corpus import NavigatingCorpus
+from test.documents.plett_document import Plett
+
+
+def test_parse_sections_referenced():
+    assert parse_sections_referenced("B.4(B)(i), B.4(B)(ii), B.4(B)(iv)(a)") == ["B.4(B)(i)", "B.4(B)(ii)", "B.4(B)(iv)(a)"]
+    assert parse_sections_referenced("") == []
+    assert parse_sections_referenced(None) == []
+
+def test_load_sections_referenced():
+    sections_referenced = load_sections_referenced("./test/inputs/manual_plus.csv", "Manual")
+    assert all(document == "Manual" for document, _ in sections_referenced.keys())
+    assert sections_referenced[("Manual", "Z.1(B)(i)(c)")] == ["B.4(B)(i)", "B.4(B)(ii)", "B.4(B)(iv)(a)"]
+
+def test_get_row_dependencies():
+    df = pd.DataFrame([["Plett", "A.2(A)", "A.1(A)"], ["WRR", "", ""]], columns=["document", "section_reference", "sections_referenced"])
+    assert get_row_dependencies(df, {("Plett", "A.2(A)"): ["A.1(B)"]}) == [{("Plett", "A.2(A)"), ("Plett", "A.1(A)"), ("Plett", "A.1(B)")}, set()]
+
+    # a section depends on what its descendants reference, in its own document only
+    corpus = NavigatingCorpus()
+    df = pd.DataFrame([["Plett", "A.2"], ["Plett", "A.2(B)"], ["Plett", "A.1"]], columns=["document", "section_reference"])
+    dependencies = get_row_dependencies(df, {("Plett", "A.2(B)(i)"): ["A.1(A)"], ("WRR", "A.1"): ["1.1"]}, corpus)
+    assert dependencies == [{("Plett", "A.2"), ("Plett", "A.1(A)")}, {("Plett", "A.2(B)"), ("Plett", "A.1(A)")}, {("Plett", "A.1")}]
+
+def test_incremental_rebuild(tmp_path, caplog):
+    corpus = NavigatingCorpus()
+    index = pd.read_parquet("./test/inputs/navigation_index.parquet", engine="pyarrow")
+    embedded = []
+    def get_embedding(text):
+        embedded.append(text)
+        return np.zeros(4)
+
+    # first build: there are no previous hashes so every row is stale but, without rebuild_text, no text changes so
+    # nothing is embedded
+    _, section_hashes, stale = incremental_rebuild(index, corpus, load_section_hashes(str(tmp_path / "hashes.parquet")), get_embedding)
+    assert stale.all() and embedded == []
+    assert "were not rebuilt because there is no token_limit or rebuild_text" in caplog.text
+    save_section_hashes(section_hashes, str(tmp_path / "hashes.parquet"))
+
+    # amend one section of Plett
+    plett = Plett()
+    df = plett.document_as_df.copy()
+    row = df.index[df["section_reference"] == "A.2(B)(i)"][0]
+    df.loc[row, "text"] = df.loc[row, "text"] + " Mind the speed bumps."
+    plett.document_as_df = df
+    corpus.reload_document("Plett", plett)
+
+    def rebuild_text(row, corpus):
+        return row["text"] + " (updated)"
+    updated, _, stale = incremental_rebuild(index, corpus, load_section_hashes(str(tmp_path / "hashes.parquet")), get_embedding, rebuild_text=rebuild_text)
+    assert index.loc[stale, "section_reference"].to_list() == ["A.2(B)"]
+    assert embedded == ["How do I get to Robberg Nature Reserve? (updated)"]
+    for i in range(len(index)):
+        if stale.iloc[i]:
+            assert np.array_equal(updated["embedding"].iloc[i], np.zeros(4))
+        else:
+            assert updated["embedding"].iloc[i] is index["embedding"].iloc[i]
+    assert index["text"].to_list()[4] == "How do I get to Robberg Nature Reserve?"
+
+def _plett_chunks(plett, token_limit):
+    toc = plett.get_toc()
+    chunks = split_tree(toc.root, plett, toc, token_limit)
+    chunks.insert(0, "document", "Plett")
+    return chunks
+
+def _amend_plett(corpus):
+    plett = Plett()
+    df = plett.document_as_df.copy()
+    row = df.index[df["section_reference"] == "A.2(B)(i)"][-1]
+    df.loc[row, "text"] = df.loc[row, "text"] + ". Mind the speed bumps on Robberg Road. There are many of them and some of them are high so slow down before you reach each one."
+    plett.document_as_df = df
+    corpus.reload_document("Plett", plett)
+    return plett
+
+def test_incremental_rebuild_rechunks(tmp_path):
+    corpus = NavigatingCorpus()
+    chunks = _plett_chunks(Plett(), 150)
+    chunks["embedding"] = [np.ones(4)] * len(chunks)
+    _, section_hashes, _ = incremental_rebuild(chunks, corpus, load_section_hashes(str(tmp_path / "hashes.parquet")), None, token_limit=150)
+
+    # the amended section no longer fits in the chunk A.2(B) so it is split into its children
+    plett = _amend_plett(corpus)
+    embedded = []
+    def get_embedding(text):
+        embedded.append(text)
+        return np.zeros(4)
+    updated, _, stale = incremental_rebuild(chunks, corpus, section_hashes, get_embedding, token_limit=150)
+    assert chunks.loc[stale, "section_reference"].to_list() == ["A.2(B)"]
+    expected = _plett_chunks(plett, 150)
+    assert updated.drop(columns=["embedding"]).equals(expected)
+    assert embedded == expected["text"].to_list()[-3:]
+    assert all(np.array_equal(embedding, np.ones(4)) for embedding in updated["embedding"].iloc[:-3])
+
+def test_rebuild_index_file(tmp_path):
+    corpus = NavigatingCorpus()
+    path_to_index = str(tmp_path / "chunks.parquet")
+    path_to_section_hashes = str(tmp_path / "hashes.parquet")
+    chunks = _plett_chunks(Plett(), 150)
+    chunks["embedding"] = [np.ones(4)] * len(chunks)
+    chunks.to_parquet(path_to_index, engine="pyarrow", index=False)
+    rebuild_index_file(path_to_index, corpus, path_to_section_hashes, None, token_limit=150)
+
+    plett = _amend_plett(corpus)
+    updated, stale = rebuild_index_file(path_to_index, corpus, path_to_section_hashes, lambda text: np.zeros(4), token_limit=150)
+    assert stale.sum() == 1
+    saved = load_parquet_data(path_to_index)
+    assert saved.drop(columns=["embedding"]).equals(_plett_chunks(plett, 150))
+    assert np.array_equal(np.stack(saved["embedding"].to_list()), np.stack(updated["embedding"].to_list()))
+
+    # nothing has changed since the last build
+    _, stale = rebuild_index_file(path_to_index, corpus, path_to_section_hashes, None, token_limit=150)
+    assert not stale.any()
@@ -1,6 +1,8 @@
 import pytest
 from regulations_rag.document import Document
 from .navigating_corpus import NavigatingCorpus
+from regulations_rag.corpus import split_corpus
+from regulations_rag.regulation_table_of_content import split_tree
 
 
 @pytest.fixture
@@ -32,4 +34,90 @@ def test_get_text_nonexistent_document(navigating_corpus):
     assert navigating_corpus.get_text("NonExistentDoc", "1") is None
 
 def test_get_heading_nonexistent_document(navigating_corpus):
-    assert navigating_corpus.get_heading("NonExistentDoc", "1") is None
\ No newline at end of file
+    assert navigating_corpus.get_heading("NonExistentDoc", "1") is None
+
+def test_get_text_uses_render_cache(navigating_corpus):
+    first = navigating_corpus.get_text("WRR", "1.2")
+    second = navigating_corpus.get_text("WRR", "1.2")
+    assert first == second
+    stats = navigating_corpus.render_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+def test_reload_document_invalidates_render_cache(navigating_corpus):
+    navigating_corpus.get_text("WRR", "1.2")
+    navigating_corpus.get_text("Plett", "A.1")
+    navigating_corpus.reload_document("WRR", navigating_corpus.get_document("WRR"))
+    assert len(navigating_corpus.render_cache) == 1
+
+def test_split_corpus(navigating_corpus):
+    chunks = split_corpus(navigating_corpus, token_limit=100, max_workers=2)
+    assert chunks["document"].unique().tolist() == ["WRR", "Plett"]
+    for document_key in ["WRR", "Plett"]:
+        document = navigating_corpus.get_document(document_key)
+        toc = document.get_toc()
+        expected_df = split_tree(toc.root, document, toc, 100)
+        document_chunks = chunks[chunks["document"] == document_key].drop(columns=["document"]).reset_index(drop=True)
+        assert document_chunks.equals(expected_df)
+
+def test_lazy_documents():
+    import threading
+    from regulations_rag.corpus import Corpus, LazyDocument
+    from test.documents.wrr_document import WRR
+    from test.documents.plett_document import Plett
+
+    constructed = []
+    def make_wrr():
+        constructed.append("WRR")
+        return WRR()
+
+    corpus = Corpus({"WRR": LazyDocument(make_wrr), "Plett": LazyDocument(Plett)}, warmup=["Plett"])
+    assert not corpus.is_document_loaded("WRR")
+    assert corpus.is_document_loaded("Plett")
+
+    threads = [threading.Thread(target=corpus.get_document, args=("WRR",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert constructed == ["WRR"]
+    assert isinstance(corpus.get_document("WRR"), WRR)
+    assert corpus.get_text("WRR", "1", add_markdown_decorators=False, section_only=True) == NavigatingCorpus().get_text("WRR", "1", add_markdown_decorators=False, section_only=True)
+    # attributes are forwarded to the document
+    assert corpus.all_documents["WRR"].name == corpus.get_document("WRR").name
+
+def test_find_class_names_in_files(tmp_path):
+    import os
+    from regulations_rag.corpus import find_class_names_in_files, get_discovery_cache_file, MIN_FILES_FOR_PARALLEL_DISCOVERY
+
+    folder = tmp_path / "documents"
+    folder.mkdir()
+    (folder / "first.py").write_text("import os\n\ndef helper():\n    class Inner:\n        pass\n\nclass First:\n    pass\n")
+    (folder / "nested.py").write_text("def helper():\n    class Nested:\n        pass\n")
+    (folder / "no_class.py").write_text("x = 1\n")
+    (folder / "notes.txt").write_text("class NotPython:\n")
+
+    cache_file = get_discovery_cache_file(str(folder))
+    assert cache_file == str(tmp_path / "documents.class_names.json")
+    expected = {"first": "First", "nested": "Nested"}
+    # the cache is only used if it is asked for
+    assert find_class_names_in_files(str(folder)) == expected
+    assert not os.path.exists(cache_file)
+    assert find_class_names_in_files(str(folder), cache_file=cache_file) == expected
+    assert os.path.exists(cache_file)
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+    # served from the cache
+    assert find_class_names_in_files(str(folder), cache_file=cache_file) == expected
+
+    (folder / "first.py").write_text("class Changed:\n    pass\n")
+    os.utime(folder / "first.py", ns=(1, 1))
+    assert find_class_names_in_files(str(folder), cache_file=cache_file)["first"] == "Changed"
+
+    # a cache that can't be written does not stop discovery
+    assert find_class_names_in_files(str(folder), cache_file=str(tmp_path / "missing" / "cache.json"))["first"] == "Changed"
+
+    for i in range(MIN_FILES_FOR_PARALLEL_DISCOVERY):
+        (folder / f"doc_{i}.py").write_text(f"class Doc{i}:\n    pass\n")
+    class_names = find_class_names_in_files(str(folder), cache_file=None, max_workers=2)
+    assert class_names[f"doc_{MIN_FILES_FOR_PARALLEL_DISCOVERY - 1}"] == f"Doc{MIN_FILES_FOR_PARALLEL_DISCOVERY - 1}"
+    assert len(class_names) == MIN_FILES_FOR_PARALLEL_DISCOVERY + 2
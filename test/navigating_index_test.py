@@ -57,3 +57,27 @@ def test_cap_rag_section_token_length(navigating_index):
     assert "token_count" in capped_sections.columns
     assert capped_sections["token_count"].sum() <= 100
 
+
+def test_lazy_decryption():
+    from cryptography.fernet import Fernet
+    from regulations_rag.corpus_index import DataFrameCorpusIndex
+    from regulations_rag.file_tools import LazyTextDecryptor
+    from .navigating_corpus import NavigatingCorpus
+
+    key = Fernet.generate_key().decode()
+    fernet = Fernet(key)
+    frames = [pd.read_parquet(f"./test/inputs/{name}.parquet", engine="pyarrow") for name in ["navigation_dfns", "navigation_index", "navigation_workflow"]]
+    plain_text = [df["text"].to_list() for df in frames]
+    for df in frames:
+        df["text"] = df["text"].apply(lambda x: fernet.encrypt(x.encode()).decode())
+
+    decryptor = LazyTextDecryptor(key)
+    index = DataFrameCorpusIndex("a Visitor", "Plett", NavigatingCorpus(), frames[0], frames[1], frames[2], text_decryptor=decryptor)
+    dfns = index.get_relevant_definitions("", frames[0].iloc[1]["embedding"], threshold=0.0001)
+    assert dfns["text"].to_list() == [plain_text[0][1]]
+    # only the returned row was decrypted and the index still holds the encrypted text
+    assert decryptor.cache_info().currsize == 1
+    assert index.definitions["text"].iloc[1] != plain_text[0][1]
+
+    workflow = index.get_relevant_workflow("", frames[2].iloc[0]["embedding"], threshold=0.0001)
+    assert workflow["text"].to_list() == [plain_text[2][0]]
@@ -135,6 +135,14 @@ def test_check_response_RAG(dummy_definitions, dummy_search_sections):
     assert result["section"] == "1.1.2"
 
 
+    # test case for SECTION response with a known reference inside other text
+    llm_response = f"{PathRAG.LLMPrefix.SECTION.value} Extract 2, Reference: section 1.3 of the manual"
+    llm_message_response = {"role": "assistant", "content": llm_response}   
+    result = path_rag.check_response_RAG(llm_message_response = llm_message_response, df_definitions = dummy_definitions, df_sections = dummy_search_sections)
+    assert result["RAGPath"] == PathRAG.RAGPath.SECTION.value
+    assert result["document"] == "WRR"
+    assert result["section"] == "1.3"
+
     # test case for SECTION response when references are not specified correctly 
     llm_response = f"{PathRAG.LLMPrefix.SECTION.value} Reference 1, Section 1.1.2"
     llm_message_response = {"role": "assistant", "content": llm_response}   
@@ -185,6 +185,117 @@ class TestReferenceChecker:
 
 
 
+class TestCombinedPattern:
+
+    def _split_by_level(self, reference_checker, reference):
+        combined_pattern = reference_checker._combined_pattern
+        reference_checker._combined_pattern = None
+        try:
+            return reference_checker.is_valid(reference), reference_checker.split_reference(reference)
+        except ValueError:
+            return reference_checker.is_valid(reference), None
+        finally:
+            reference_checker._combined_pattern = combined_pattern
+
+    def test_combined_pattern_matches_level_by_level(self):
+        references = ["", "A.1", "G.1(C)(xviii)(c)(dd)(9)", "G.1(C)(xviii)(c)(dd)(9)(10)", "(C)(xviii)", "(i)", "(i)(a)",
+                      "(a)", "(a)(1)", "G.1(C)(xviii)(c)(DD)(9)", "A.1 ", "Legal context", "1.2.3", "1.2.3.4", ".1",
+                      "3.4.2.1", "Application. Annex 2.1", "Application. Annex", ". Part 2.1", "Applications"]
+        for reference_checker in [TESTReferenceChecker(), SimpleReferenceChecker(), MainSection(), AltSection()]:
+            assert reference_checker._combined_pattern is not None
+            for reference in references:
+                is_valid, components = self._split_by_level(reference_checker, reference)
+                assert reference_checker.is_valid(reference) == is_valid
+                if components is None:
+                    with pytest.raises(ValueError):
+                        reference_checker.split_reference(reference)
+                else:
+                    assert reference_checker.split_reference(reference) == components
+
+    def test_falls_back_for_left_context_assertions(self):
+        reference_checker = ReferenceChecker([r'^[A-Z]', r'^\b\d'])
+        assert reference_checker._combined_pattern is None
+        assert reference_checker.is_valid("A1")
+        assert reference_checker.split_reference("A1") == ["A", "1"]
+        # in the first level they are fine because the first level always starts at the beginning of the reference
+        reference_checker = ReferenceChecker([r'\bA\b', r'\.\d'])
+        assert reference_checker._combined_pattern is not None
+        assert reference_checker.split_reference("A.1") == ["A", ".1"]
+
+    def test_references_that_are_not_strings(self):
+        for reference_checker in [TESTReferenceChecker(), ReferenceChecker([r'^[A-Z]', r'^\b\d'])]:
+            for reference in [None, float("nan")]:
+                assert not reference_checker.is_valid(reference)
+                assert reference_checker.split_reference(reference) == []
+
+
+class TestBulkReferences:
+
+    def test_validate_many(self):
+        reference_checker = TESTReferenceChecker()
+        references = pd.Series(['G.1(C)(xviii)(c)(dd)(9)', 'G.1(C)(xviii)(c)(c)(9)', '', None, 'Legal context', '(C)(xviii)'], index=[10, 11, 12, 13, 14, 15])
+        mask = reference_checker.validate_many(references)
+        assert mask.index.tolist() == [10, 11, 12, 13, 14, 15]
+        assert mask.tolist() == [True, False, False, False, True, True]
+
+        # subclasses that override is_valid are called one reference at a time
+        multi = MultiReferenceChecker([MainSection(), AltSection()])
+        assert multi.validate_many(["3.4.2.1", "Application. Annex 2.1", "Application. Annex"]).tolist() == [True, True, False]
+
+    def test_split_many(self):
+        reference_checker = TESTReferenceChecker()
+        references = ['G.1(C)(xviii)', '(C)(xviii)', 'G.1(c)', 'Legal context', '']
+        components = reference_checker.split_many(references)
+        assert components.columns.tolist() == [f"component_{i}" for i in range(6)]
+        for reference, (_, row) in zip(references, components.iterrows()):
+            expected = reference_checker.split_reference(reference) if reference_checker.is_valid(reference) else []
+            assert row.dropna().tolist() == expected
+
+        multi = MultiReferenceChecker([MainSection(), AltSection()])
+        components = multi.split_many(["3.4.2.1", "Application. Part 2", "x"])
+        assert components.iloc[0].dropna().tolist() == ["3", ".4", ".2", ".1"]
+        assert components.iloc[1].dropna().tolist() == ["Application", ". Part 2"]
+        assert components.iloc[2].dropna().tolist() == []
+
+
+class TestReferenceCaches:
+
+    def test_repeat_calls_are_cached(self):
+        reference_checker = TESTReferenceChecker()
+        assert reference_checker.get_current_and_parent_references('G.1(C)(xviii)') == ['G.1(C)(xviii)', 'G.1(C)', 'G.1']
+        misses = reference_checker.cache_info()["split_reference"].misses
+        assert reference_checker.get_current_and_parent_references('G.1(C)(xviii)') == ['G.1(C)(xviii)', 'G.1(C)', 'G.1']
+        assert reference_checker.get_parent_reference('G.1(C)') == 'G.1'
+        assert reference_checker.cache_info()["split_reference"].misses == misses
+        assert reference_checker.cache_info()["get_current_and_parent_references"].hits == 1
+        assert reference_checker.is_reference_or_parents_in_list('G.1(C)(xviii)', ['G.1'])
+
+        # callers get a copy so they can't change the cached value
+        components = reference_checker.split_reference('G.1(C)')
+        components.append('(i)')
+        assert reference_checker.split_reference('G.1(C)') == ['G.1', '(C)']
+
+        with pytest.raises(ValueError):
+            reference_checker.split_reference('G.1(c)')
+        with pytest.raises(ValueError):
+            reference_checker.split_reference('G.1(c)')
+
+        reference_checker.cache_clear()
+        assert reference_checker.cache_info()["split_reference"].currsize == 0
+
+    def test_bounded(self):
+        reference_checker = ReferenceChecker([r'^[1-9]', r'^\.[1-9]'], cache_size=2)
+        for reference in ["1", "2", "3", "1.1"]:
+            reference_checker.split_reference(reference)
+        assert reference_checker.cache_info()["split_reference"].currsize == 2
+
+    def test_pickle(self):
+        import pickle
+        reference_checker = pickle.loads(pickle.dumps(TESTReferenceChecker()))
+        assert reference_checker.get_parent_reference('G.1(C)') == 'G.1'
+        assert reference_checker.cache_info()["get_parent_reference"].misses == 1
+
+
 class TestEmptyReferenceChecker():
     no_reference = EmptyReferenceChecker()
 
@@ -249,6 +360,31 @@ class TestMultiReferenceChecker():
         assert self.doc_ref_checker.get_parent_reference("3.4.2.1") == "3.4.2"
         assert self.doc_ref_checker.get_parent_reference("Application. Part 2") == "Application"
 
+    def test_dispatch(self):
+        assert self.doc_ref_checker._dispatch_pattern is not None
+        assert self.doc_ref_checker._find_reference_checker("3.4.2.1") is self.main
+        assert self.doc_ref_checker._find_reference_checker("Application. Annex 2.1") is self.alt
+        assert self.doc_ref_checker._find_reference_checker("Application. Annex") is None
+        assert self.doc_ref_checker.split_reference("Application. Part 2.1") == ["Application", ". Part 2", ".1"]
+
+        # the first checker that considers the reference valid wins, including its exclusion list
+        test_checker = TESTReferenceChecker()
+        simple_checker = SimpleReferenceChecker()
+        multi = MultiReferenceChecker([simple_checker, test_checker])
+        assert multi._find_reference_checker("1.1") is simple_checker
+        assert multi._find_reference_checker("A.1(B)") is test_checker
+        assert multi._find_reference_checker("Legal context") is test_checker
+
+    def test_dispatch_falls_back_for_overridden_is_valid(self):
+        class PrefixedSection(MainSection):
+            def is_valid(self, reference):
+                return super().is_valid(reference.removeprefix("Section "))
+
+        multi = MultiReferenceChecker([PrefixedSection(), self.alt])
+        assert multi._dispatch_pattern is None
+        assert multi.is_valid("Section 3.4")
+        assert multi.is_valid("Application. Annex 2")
+
 
 class TestSimpleReferenceChecker():
     rc = SimpleReferenceChecker()
@@ -2,8 +2,9 @@ import pytest
 import pandas as pd
 from unittest.mock import Mock
 from regulations_rag.reference_checker import ReferenceChecker
-from regulations_rag.regulation_table_of_content import StandardTableOfContent, TableOfContentEntry, split_tree
+from regulations_rag.regulation_table_of_content import StandardTableOfContent, TableOfContentEntry, split_tree, split_tree_single_pass, split_tree_parallel, _init_split_worker, _split_node_worker
 from test.reference_checker_samples import SimpleReferenceChecker
+from test.documents.plett_document import Plett
 
        
 
@@ -74,3 +75,88 @@ def test_split_tree(standard_toc):
     assert 'section_reference' in result_df.columns
     assert 'text' in result_df.columns
     assert 'token_count' in result_df.columns
+
+def test_children_by_name(standard_toc):
+    node = standard_toc.get_node('1')
+    assert node.get_child('.1') is node.children[0]
+    assert node.get_child('.2') is None
+    standard_toc.add_to_toc('1.2', 'New heading')
+    assert node.get_child('.2').heading_text == 'New heading'
+    node.get_child('.2').parent = None
+    assert node.get_child('.2') is None
+
+def test_detached_nodes_are_removed_from_nodes_by_reference(standard_toc):
+    standard_toc.get_node('1.1').parent = None
+    assert set(standard_toc.nodes_by_reference.keys()) == {'1'}
+    with pytest.raises(ValueError):
+        standard_toc.get_node('1.1.1')
+
+def test_nodes_by_reference(standard_toc):
+    assert set(standard_toc.nodes_by_reference.keys()) == {'1', '1.1', '1.1.1'}
+    assert standard_toc.get_node('1.1.1') is standard_toc.nodes_by_reference['1.1.1']
+    standard_toc.add_to_toc('2.1')
+    assert standard_toc.get_node('2').children[0] is standard_toc.get_node('2.1')
+    with pytest.raises(ValueError):
+        standard_toc.get_node('3.1')
+
+def test_invalid_rows_are_reported_together(reference_checker):
+    data = {
+        'text': ['Text 1', 'Text 2', 'Text 3', 'Text 4'],
+        'heading': [True, True, True, True],
+        'section_reference': ['1', 'invalid', '1.1', 'also invalid']
+    }
+    with pytest.raises(ValueError) as error:
+        StandardTableOfContent(root_node_name="root", reference_checker=reference_checker, regulation_df=pd.DataFrame(data))
+    assert "row 1: 'invalid'" in str(error.value)
+    assert "row 3: 'also invalid'" in str(error.value)
+
+def test_repeated_references_use_the_first_heading(reference_checker):
+    data = {
+        'text': ['Text 1.1.1', 'Text 1', 'Body text', 'Second heading', 'Text 1.1'],
+        'heading': [True, True, False, True, True],
+        'section_reference': ['1.1.1', '1', '1', '1', '1.1']
+    }
+    toc = StandardTableOfContent(root_node_name="root", reference_checker=reference_checker, regulation_df=pd.DataFrame(data))
+    assert toc.get_node('1').heading_text == 'Text 1'
+    assert toc.get_node('1.1').heading_text == 'Text 1.1'
+    assert toc.get_node('1.1.1').heading_text == 'Text 1.1.1'
+    assert len(toc.root.children) == 1
+
+def test_split_tree_renders_each_chunk_once(standard_toc):
+    document = Mock()
+    document.get_text.side_effect = lambda x: "sample text"
+    result_df = split_tree(standard_toc.root, document, standard_toc, 100)
+    assert len(result_df) == 1
+    assert document.get_text.call_count == 1
+
+def test_split_tree_single_pass():
+    plett = Plett()
+    toc = plett.get_toc()
+    for token_limit in [100, 300, 1000]:
+        expected_df = split_tree(toc.root, plett, toc, token_limit)
+        result_df = split_tree_single_pass(toc.root, plett, token_limit)
+        assert result_df.equals(expected_df)
+        assert result_df["token_count"].max() <= token_limit
+
+    with pytest.raises(Exception):
+        split_tree_single_pass(toc.root, plett, 10)
+
+def test_split_tree_parallel():
+    plett = Plett()
+    toc = plett.get_toc()
+    for token_limit in [100, 1000]:
+        expected_df = split_tree(toc.root, plett, toc, token_limit)
+        result_df = split_tree_parallel(plett, token_limit, max_workers=2)
+        assert result_df.equals(expected_df)
+
+def test_split_tree_parallel_root_without_children(reference_checker):
+    toc = StandardTableOfContent(root_node_name="root", reference_checker=reference_checker, regulation_df=pd.DataFrame({'text': [], 'heading': [], 'section_reference': []}))
+    document = Mock()
+    document.get_text.side_effect = lambda x: "word " * 200
+    document.get_cached_toc.return_value = toc
+    with pytest.raises(Exception, match="has no children"):
+        split_tree(toc.root, document, toc, 100)
+    # the root check in the worker raises the same error rather than returning no chunks for the document
+    _init_split_worker({"doc": document})
+    with pytest.raises(Exception, match="has no children"):
+        _split_node_worker("doc", None, 100)
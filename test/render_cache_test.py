@@ -0,0 +1,39 @@
+import sys
+from regulations_rag.render_cache import RenderCache
+
+
+def test_get_and_put():
+    cache = RenderCache()
+    key = RenderCache.make_key("WRR", "1.2")
+    assert cache.get(key) is None
+    cache.put(key, "some text")
+    assert cache.get(key) == "some text"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_byte_budget_evicts_least_recently_used():
+    text = "x" * 100
+    cache = RenderCache(max_bytes=2 * sys.getsizeof(text))
+    cache.put("a", text)
+    cache.put("b", text)
+    cache.get("a")
+    cache.put("c", text)
+    assert cache.get("b") is None
+    assert cache.get("a") == text
+    assert cache.get("c") == text
+    assert cache.evictions == 1
+    assert cache.current_bytes <= cache.max_bytes
+
+def test_text_larger_than_budget_is_not_cached():
+    cache = RenderCache(max_bytes=10)
+    cache.put("a", "x" * 100)
+    assert len(cache) == 0
+
+def test_invalidate_document():
+    cache = RenderCache()
+    cache.put(RenderCache.make_key("WRR", "1"), "text 1")
+    cache.put(RenderCache.make_key("WRR", "1.1", add_markdown_decorators=False), "text 1.1")
+    cache.put(RenderCache.make_key("Plett", "A.1"), "text A.1")
+    cache.invalidate_document("WRR")
+    assert len(cache) == 1
+    assert cache.get(RenderCache.make_key("Plett", "A.1")) == "text A.1"
@@ -0,0 +1,57 @@
+import pytest
+from regulations_rag.section_store import build_section_store, save_section_store, SectionStore, DEFAULT_RENDER_FLAGS
+from regulations_rag.corpus import Corpus
+from .navigating_corpus import NavigatingCorpus
+from .documents.wrr_document import WRR
+
+
+@pytest.fixture
+def wrr_document():
+    return WRR()
+
+def test_build_section_store(wrr_document):
+    df = build_section_store(wrr_document)
+    number_of_nodes = 5 # root, 1, 1.1, 1.2, 1.3
+    assert len(df) == number_of_nodes * len(DEFAULT_RENDER_FLAGS)
+    row = df[(df["section_reference"] == "1.2") & (df["add_markdown_decorators"] == False)].iloc[0]
+    assert row["text"] == wrr_document.get_text("1.2", add_markdown_decorators=False)
+    assert row["token_count"] > 0
+
+def test_section_store_round_trip(wrr_document, tmp_path):
+    path_to_file = str(tmp_path / "wrr_sections.parquet")
+    save_section_store(build_section_store(wrr_document), path_to_file)
+    store = SectionStore.from_file(path_to_file)
+    assert store.get_text("1.2") == wrr_document.get_text("1.2")
+    assert store.get_text("1.2", add_markdown_decorators=False) == wrr_document.get_text("1.2", add_markdown_decorators=False)
+    assert store.get_text("1.2", section_only=True) is None # not rendered at build time
+
+def test_section_store_missing_file():
+    with pytest.raises(FileNotFoundError):
+        SectionStore.from_file("./test/inputs/does_not_exist.parquet")
+
+def test_corpus_serves_from_section_store(wrr_document, tmp_path):
+    path_to_file = str(tmp_path / "wrr_sections.parquet")
+    save_section_store(build_section_store(wrr_document), path_to_file)
+    corpus = NavigatingCorpus()
+    assert corpus.get_document("WRR").load_section_store(path_to_file)
+    corpus.get_document("WRR").get_text = None # the request path must not render the text
+    assert corpus.get_text("WRR", "1.2") == wrr_document.get_text("1.2")
+    assert corpus.get_token_count("WRR", "1.2") > 0
+
+def test_section_store_is_dropped_when_the_document_changes(wrr_document, tmp_path):
+    path_to_file = str(tmp_path / "wrr_sections.parquet")
+    save_section_store(build_section_store(wrr_document), path_to_file)
+    corpus = Corpus({"WRR": wrr_document}, render_cache_max_bytes=0)
+    document = corpus.get_document("WRR")
+    assert document.load_section_store(path_to_file)
+    assert document.get_stored_text("1.2") is not None
+
+    df = document.document_as_df.copy()
+    df.loc[df["section_reference"] == "1.2", "text"] = "To the NEW Main Gate"
+    document.document_as_df = df
+    assert document.get_stored_text("1.2") is None
+    assert "To the NEW Main Gate" in corpus.get_text("WRR", "1.2")
+
+    # a store built from the previous version of the document is not used
+    assert not document.load_section_store(path_to_file)
+    assert document.get_stored_text("1.2") is None
@@ -0,0 +1,49 @@
+import pandas as pd
+from regulations_rag.term_scanner import AhoCorasick, CorpusScanner, extract_defined_term
+from regulations_rag.corpus import Corpus, LazyDocument
+from regulations_rag.corpus_bundle import save_corpus_bundle
+from test.navigating_corpus import NavigatingCorpus
+from test.documents.plett_document import Plett
+from test.documents.wrr_document import WRR
+
+
+def test_aho_corasick():
+    automaton = AhoCorasick()
+    for pattern in ["he", "she", "his", "hers"]:
+        automaton.add(pattern, pattern)
+    matches = sorted(automaton.iter_matches("ushers"))
+    assert matches == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+    assert list(AhoCorasick().iter_matches("ushers")) == []
+
+def test_extract_defined_term():
+    assert extract_defined_term("The Gym: The Health and Fitness Center on Piesang Valley Road") == "The Gym"
+    assert extract_defined_term("Treasury means, in relation to any matter contemplated in the Regulations") == "Treasury"
+    assert extract_defined_term("An inward foreign loan is when money is borrowed from abroad.") is None
+
+def test_find_references():
+    corpus = NavigatingCorpus()
+    scanner = CorpusScanner(corpus=corpus)
+    text = "See A.2(B)(iii) and 1.3, but not A.21, a.2 or 1.35."
+    assert scanner.find_references(text) == [("Plett", "A.2(B)(iii)"), ("WRR", "1.3")]
+    matches = scanner.scan(text, longest_only=False)
+    assert [match.value for match in matches] == ["A.2(B)(iii)", "A.2(B)", "A.2", "1.3"]
+    assert corpus.find_references(text) == [("Plett", "A.2(B)(iii)"), ("WRR", "1.3")]
+    assert scanner.find_references("See 1.1.2") == []
+
+def test_scanner_does_not_load_bundled_documents(tmp_path):
+    path_to_bundle = str(tmp_path / "navigating.bundle")
+    save_corpus_bundle(path_to_bundle, NavigatingCorpus())
+    corpus = Corpus({"WRR": LazyDocument(WRR), "Plett": LazyDocument(Plett)}, bundle=path_to_bundle)
+    assert corpus.find_references("See A.2(B)(iii) and 1.3") == [("Plett", "A.2(B)(iii)"), ("WRR", "1.3")]
+    assert not corpus.is_document_loaded("WRR")
+    assert not corpus.is_document_loaded("Plett")
+
+def test_find_definitions():
+    definitions = pd.DataFrame([["Plett", "A.1(A)", "The Gym: The Health and Fitness Center on Piesang Valley Road"],
+                                ["Plett", "A.1(A)", "The Robberg Nature Reserve: The Cape Nature park at the end of the Robberg Peninsula"],
+                                ["WRR", "1", "Turnstone means the house at number 11"]],
+                               columns=["document", "section_reference", "definition"], index=[5, 6, 7])
+    scanner = CorpusScanner(definitions=definitions)
+    found = scanner.find_definitions("Walk past the gym to the Robberg Nature Reserve. Turnstones are birds.")
+    assert found.index.tolist() == [5, 6]
+    assert scanner.find_references("A.1") == []
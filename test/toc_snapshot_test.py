@@ -0,0 +1,112 @@
+import os
+import pytest
+from unittest.mock import patch
+from regulations_rag.toc_snapshot import content_hash, document_source_hash, save_toc_snapshot, load_toc_snapshot, toc_to_frame
+from regulations_rag.corpus import Corpus
+from test.documents.plett_document import Plett
+from test.documents.wrr_document import WRR
+
+
+@pytest.fixture
+def plett():
+    return Plett()
+
+def test_content_hash(plett):
+    df = plett.document_as_df
+    assert content_hash(df) == content_hash(df.copy())
+    changed_df = df.copy()
+    changed_df.loc[0, "text"] = "Changed"
+    assert content_hash(df) != content_hash(changed_df)
+    assert content_hash(df) != content_hash(df, extra="root")
+
+def test_toc_to_frame(plett):
+    nodes_df = toc_to_frame(plett.get_toc())
+    row = nodes_df[nodes_df["full_node_name"] == "A.2(A)(i)"].iloc[0]
+    assert row["parent_full_node_name"] == "A.2(A)"
+    assert row["heading_text"] == "From West Gate (see 1.1)"
+
+def test_snapshot_round_trip(plett, tmp_path):
+    path_to_file = str(tmp_path / "plett.toc.parquet")
+    toc = plett.get_toc()
+    source_hash = content_hash(plett.document_as_df)
+    save_toc_snapshot(toc, path_to_file, source_hash)
+
+    loaded_toc = load_toc_snapshot(path_to_file, plett.reference_checker, source_hash, plett.document_as_df)
+    assert [node.full_node_name for node in loaded_toc.root.descendants] == [node.full_node_name for node in toc.root.descendants]
+    assert loaded_toc.get_node("A.2(B)").heading_text == "To Robberg Nature Reserve"
+    assert loaded_toc.get_node("A.2(B)").children[0].name == "(i)"
+
+    assert load_toc_snapshot(path_to_file, plett.reference_checker, "a different hash") is None
+    assert load_toc_snapshot(str(tmp_path / "missing.parquet"), plett.reference_checker, source_hash) is None
+
+def test_document_uses_snapshot(tmp_path):
+    corpus = Corpus({"Plett": Plett()}, toc_cache_folder=str(tmp_path))
+    assert os.path.exists(tmp_path / "Plett.toc.parquet")
+
+    plett = Plett()
+    plett.toc_cache_folder = str(tmp_path)
+    with patch.object(Plett, "get_toc", side_effect=AssertionError("the snapshot should have been used")):
+        text = plett.get_text("A.2(A)")
+    assert text == corpus.get_text("Plett", "A.2(A)")
+
+def test_changed_document_rebuilds_snapshot(tmp_path):
+    wrr = WRR()
+    wrr.toc_cache_folder = str(tmp_path)
+    wrr.get_cached_toc()
+    changed_df = wrr.document_as_df.copy()
+    changed_df.loc[2, "text"] = "To the West Gate"
+    wrr.document_as_df = changed_df
+    assert wrr.get_cached_toc().get_node("1.1").heading_text == "To the West Gate"
+
+def test_document_source_hash(plett):
+    source_hash = document_source_hash(plett)
+    assert source_hash == document_source_hash(Plett())
+    changed_checker = Plett()
+    changed_checker.reference_checker.exclusion_list = ["Legal context"]
+    assert document_source_hash(changed_checker) != source_hash
+    # the same data in a document of a different class
+    wrr = WRR()
+    wrr.name = plett.name
+    wrr.reference_checker = plett.reference_checker
+    wrr.document_as_df = plett.document_as_df
+    assert document_source_hash(wrr) != source_hash
+
+def test_custom_toc_is_not_snapshotted(tmp_path):
+    from regulations_rag.regulation_table_of_content import StandardTableOfContent
+    class CustomTableOfContent(StandardTableOfContent):
+        pass
+    class CustomPlett(Plett):
+        def get_toc(self):
+            return CustomTableOfContent(root_node_name=self.name, reference_checker=self.reference_checker, regulation_df=self.document_as_df)
+
+    plett = CustomPlett()
+    plett.toc_cache_folder = str(tmp_path)
+    assert type(plett.get_cached_toc()) is CustomTableOfContent
+    assert not os.path.exists(tmp_path / "CustomPlett.toc.parquet")
+    with pytest.raises(ValueError):
+        save_toc_snapshot(plett.get_cached_toc(), str(tmp_path / "custom.toc.parquet"), "hash")
+
+def test_toc_with_its_own_reference_checker_is_not_snapshotted(tmp_path):
+    from regulations_rag.regulation_table_of_content import StandardTableOfContent
+    from test.reference_checker_samples import TESTReferenceChecker
+    class AnnexReferenceChecker(TESTReferenceChecker):
+        def __init__(self):
+            super().__init__()
+            self.exclusion_list = self.exclusion_list + ["Annex"]
+    class AnnexPlett(Plett):
+        def get_toc(self):
+            return StandardTableOfContent(root_node_name=self.name, reference_checker=AnnexReferenceChecker(), regulation_df=self.document_as_df)
+
+    plett = AnnexPlett()
+    plett.toc_cache_folder = str(tmp_path)
+    plett.get_cached_toc().add_to_toc("Annex")
+    assert not os.path.exists(tmp_path / "AnnexPlett.toc.parquet")
+
+    # a snapshot is only loaded with the kind of reference checker it was built with
+    path_to_file = str(tmp_path / "annex.toc.parquet")
+    source_hash = document_source_hash(plett)
+    save_toc_snapshot(plett.get_toc(), path_to_file, source_hash)
+    assert load_toc_snapshot(path_to_file, plett.reference_checker, source_hash) is None
+    loaded_toc = load_toc_snapshot(path_to_file, AnnexReferenceChecker(), source_hash, plett.document_as_df)
+    loaded_toc.add_to_toc("Annex")
+    assert loaded_toc.get_node("Annex").full_node_name == "Annex"